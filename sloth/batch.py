@@ -0,0 +1,420 @@
+import numpy as np
+
+from sloth.enums import (Cmd, RawBlock, Speed, MAX_SPEED, BOOST_SPEED,
+                         NEXT_SPEED, PREV_SPEED)
+from sloth.state import Player, State
+from sloth.maps import CompactGlobalMap
+from sloth.cache import bounded_cache
+
+# cmd opcodes as plain ints for comparing against the cmd arrays
+NOP, ACCEL, DECEL, LEFT, RIGHT, BOOST, LIZARD, FIX = (
+    int(c) for c in [Cmd.NOP, Cmd.ACCEL, Cmd.DECEL, Cmd.LEFT, Cmd.RIGHT,
+                     Cmd.BOOST, Cmd.LIZARD, Cmd.FIX])
+
+# speed tables as arrays, indexed by [damage, speed]
+_MAX_SPEED = np.array(MAX_SPEED)
+_BOOST_SPEED = np.array(BOOST_SPEED)
+_NEXT_SPEED = np.array(NEXT_SPEED)
+_PREV_SPEED = np.array(PREV_SPEED)
+
+# the longest path a player can drive in a round
+_MAX_PATH = Speed.BOOST_SPEED.value + 1
+
+# holds the attributes of N players as arrays
+class PlayerArrays:
+    FIELDS = ('id', 'x', 'y', 'speed', 'boosts', 'oils', 'lizards', 'tweets',
+              'emps', 'boosting', 'boost_counter', 'damage', 'score')
+
+    def __init__(self, players):
+        columns = zip(*[p._key() for p in players])
+        for field, column in zip(PlayerArrays.FIELDS, columns):
+            dtype = bool if field == 'boosting' else np.int64
+            setattr(self, field, np.array(column, dtype=dtype))
+
+    def copy(self):
+        cp = PlayerArrays.__new__(PlayerArrays)
+        for field in PlayerArrays.FIELDS:
+            setattr(cp, field, getattr(self, field).copy())
+        return cp
+
+    def __len__(self):
+        return len(self.x)
+
+    # returns the player at index i
+    def player(self, i):
+        return Player.from_key(tuple(getattr(self, field)[i].item() for field
+                                     in PlayerArrays.FIELDS))
+
+# returns the raw block codes of the global map as a read-only (y, x) array,
+# where array[y - 1, x - 1] holds the block at x, y. compact maps are read
+# straight from their lane bytearrays. cached per map version, which changes
+# whenever the map does
+@bounded_cache(maxsize=4, key=lambda global_map: global_map.version)
+def global_lanes(global_map):
+    if isinstance(global_map, CompactGlobalMap):
+        size = global_map.max_x - global_map.min_x + 1
+        lanes = np.array([np.frombuffer(lane, dtype=np.uint8)
+                          for lane in global_map.lanes], dtype=np.int64)
+        trucks = np.array([np.unpackbits(np.frombuffer(t, dtype=np.uint8),
+                                         bitorder='little')[:size]
+                           for t in global_map.trucks], dtype=bool)
+        lanes[trucks] = RawBlock.CYBERTRUCK
+    else:
+        lanes = np.array([global_map.raw_lane(y, global_map.min_x,
+                                              global_map.max_x)
+                          for y in range(global_map.min_y,
+                                         global_map.max_y + 1)])
+
+    lanes.flags.writeable = False
+    return lanes
+
+# returns the raw block codes of the map (including its view) as a read-only
+# (y, x) array, where array[y - 1, x - 1] holds the block at x, y
+def map_lanes(state_map):
+    gmap = state_map.global_map
+    lanes = global_lanes(gmap)
+
+    view = state_map.view
+    if view:
+        lanes = lanes.copy()
+        for x, y in view:
+            lanes[y - gmap.min_y, x - gmap.min_x] = state_map.raw(x, y)
+        lanes.flags.writeable = False
+
+    return lanes
+
+# a struct-of-arrays representation of N states that share the same map (i.e.
+# global map and view). players and opponents are stored as PlayerArrays
+class StateBatch:
+    def __init__(self, states, lanes=None):
+        if not states:
+            raise ValueError('cannot create an empty batch')
+
+        self.map = states[0].map
+        if any(s.map.global_map is not self.map.global_map or s.map != self.map
+               for s in states):
+            raise ValueError('all states in a batch must have the same map')
+
+        self.player = PlayerArrays([s.player for s in states])
+        self.opponent = PlayerArrays([s.opponent for s in states])
+        self.lanes = map_lanes(self.map) if lanes is None else lanes
+
+        # positions of the cybertrucks that were crashed into, these are
+        # removed from the map when converting back to states
+        self.consumed = [() for _ in states]
+
+    def __len__(self):
+        return len(self.player)
+
+    # converts the batch back to a list of states
+    def to_states(self):
+        states = []
+        for i in range(len(self)):
+            state = State()
+            state.map = self.map.copy()
+            state.player = self.player.player(i)
+            state.opponent = self.opponent.player(i)
+
+            for x, y in self.consumed[i]:
+                state.map[x, y] = state.map[x, y].get_underlay()
+
+            states.append(state)
+        return states
+
+# converts a list of cmds to an array of cmd opcodes
+def encode_cmds(cmds):
+    return np.array([int(cmd) for cmd in cmds])
+
+# the vectorized equivalent of a Trajectory
+class _Traj:
+    def __init__(self, players, cmds):
+        speed = players.speed.copy()
+        damage = players.damage.copy()
+        moving = speed > 0
+
+        accel = cmds == ACCEL
+        speed[accel] = _NEXT_SPEED[damage[accel], speed[accel]]
+        decel = cmds == DECEL
+        speed[decel] = _PREV_SPEED[damage[decel], speed[decel]]
+        boost = cmds == BOOST
+        speed[boost] = _BOOST_SPEED[damage[boost]]
+
+        x_off = speed.copy()
+        y_off = np.zeros_like(speed)
+
+        turn = (cmds == LEFT) | (cmds == RIGHT)
+        x_off[turn] = np.where(moving[turn], speed[turn] - 1, 0)
+        y_off[(cmds == LEFT) & moving] = -1
+        y_off[(cmds == RIGHT) & moving] = 1
+        x_off[cmds == FIX] = 0
+
+        self.speed = speed
+        self.damage = damage
+        self.x_off = x_off
+        self.y_off = y_off
+        self.collided = np.zeros(len(speed), dtype=bool)
+
+    # the start and end x of each path (see state.path_bounds) and whether the
+    # player moved at all
+    def path(self, players, lizarding):
+        moved = (self.x_off != 0) | (self.y_off != 0)
+        start = np.where((self.y_off != 0) & ~self.collided, players.x,
+                         players.x + 1)
+        start = np.where(lizarding, players.x + self.x_off, start)
+        end = players.x + self.x_off
+        return moved, start, end
+
+# the vectorized equivalent of PathMods
+class _Mods:
+    def __init__(self, size):
+        self.oils = np.zeros(size, dtype=np.int64)
+        self.boosts = np.zeros(size, dtype=np.int64)
+        self.lizards = np.zeros(size, dtype=np.int64)
+        self.tweets = np.zeros(size, dtype=np.int64)
+        self.emps = np.zeros(size, dtype=np.int64)
+
+        self.penalties = np.zeros(size, dtype=np.int64)
+        self.damage = np.zeros(size, dtype=np.int64)
+        self.score = np.zeros(size, dtype=np.int64)
+
+    def penalise(self, mask, score, damage):
+        self.penalties[mask] += 1
+        self.score[mask] -= score
+        self.damage[mask] += damage
+
+    def apply(self, players):
+        players.oils += self.oils
+        players.boosts += self.boosts
+        players.lizards += self.lizards
+        players.tweets += self.tweets
+        players.emps += self.emps
+
+        players.score += self.score
+        players.damage = np.minimum(players.damage + self.damage, 5)
+
+        cancel = players.boosting & (self.penalties > 0)
+        players.boosting[cancel] = False
+        players.boost_counter[cancel] = 0
+
+# returns the blocks at each path's k-th position along with a mask of the
+# paths that are still going at that position. cybertrucks that a state has
+# already crashed into are replaced with their underlay
+def _path_blocks(batch, players, traj, moved, start, end, k):
+    lanes = batch.lanes
+    x = start + k
+    active = moved & (x <= end) & (x < lanes.shape[1])
+    y = players.y + traj.y_off
+    blocks = np.full(len(x), RawBlock.EMPTY)
+    blocks[active] = lanes[y[active] - 1, x[active] - 1]
+
+    for i in np.flatnonzero(blocks == RawBlock.CYBERTRUCK):
+        pos = (x[i].item(), y[i].item())
+        if pos in batch.consumed[i]:
+            blocks[i] = batch.map[pos].get_underlay().value
+
+    return x, active, blocks
+
+def _count_boosting(players):
+    boosting = players.boosting
+    players.boost_counter[boosting] -= 1
+    ran_out = boosting & (players.boost_counter == 0)
+    players.boosting[ran_out] = False
+    players.speed[ran_out] = _MAX_SPEED[players.damage[ran_out]]
+
+def _check_fix(players, cmds):
+    fix = cmds == FIX
+    players.damage[fix] = np.maximum(0, players.damage[fix] - 2)
+
+def _track_powerups(players, cmds):
+    boost = cmds == BOOST
+    players.boosts[boost] -= 1
+    players.boosting[boost] = True
+    players.boost_counter[boost] = 5
+    players.score[boost] += 4
+
+    lizard = cmds == LIZARD
+    players.lizards[lizard] -= 1
+    players.score[lizard] += 4
+
+def _resolve_cybertruck_collisions(batch, players, traj, lizarding):
+    mods = _Mods(len(players))
+    moved, start, end = traj.path(players, lizarding)
+    hit_x = np.zeros(len(players), dtype=np.int64)
+    hit_y = players.y + traj.y_off
+    searching = moved.copy()
+
+    for k in range(_MAX_PATH + 1):
+        x, active, blocks = _path_blocks(batch, players, traj, searching, start,
+                                         end, k)
+        hit = active & (blocks == RawBlock.CYBERTRUCK)
+
+        traj.speed[hit] = Speed.SPEED_1.value
+        traj.x_off[hit] = x[hit] - players.x[hit] - 1
+        mods.penalise(hit, 7, 2)
+        hit_x[hit] = x[hit]
+        searching &= ~hit
+
+    return mods, hit_x, hit_y
+
+def _check_collisions(a, b, traj_a, traj_b, a_lizarding, b_lizarding):
+    started_same_lane = a.y == b.y
+    ended_same_lane = traj_a.y_off == traj_b.y_off
+    a_started_ahead = a.x > b.x
+    any_player_lizards = a_lizarding | b_lizarding
+    a_ended_ahead = a.x + traj_a.x_off > b.x + traj_b.x_off
+    b_ended_ahead = b.x + traj_b.x_off > a.x + traj_a.x_off
+
+    # both players end up on the same block
+    same = a_ended_ahead == b_ended_ahead
+    a_ended_ahead = np.where(same, ~a_started_ahead, a_ended_ahead)
+
+    drove_through = (a_started_ahead != a_ended_ahead) & ~any_player_lizards
+
+    # whoever is behind ends up one block behind the player in front
+    def rear_end(mask):
+        b_behind = mask & a_started_ahead
+        traj_b.x_off[b_behind] = (a.x + traj_a.x_off - 1 - b.x)[b_behind]
+        traj_b.collided[b_behind] = True
+
+        a_behind = mask & ~a_started_ahead
+        traj_a.x_off[a_behind] = (b.x + traj_b.x_off - 1 - a.x)[a_behind]
+        traj_a.collided[a_behind] = True
+
+    rear_end(started_same_lane & ended_same_lane & drove_through)
+
+    x_same = a.x + traj_a.x_off == b.x + traj_b.x_off
+    y_same = a.y + traj_a.y_off == b.y + traj_b.y_off
+    same_block = x_same & y_same
+
+    bump = same_block & ~any_player_lizards
+    traj_a.x_off[bump] -= 1
+    traj_b.x_off[bump] -= 1
+    traj_a.y_off[bump] = 0
+    traj_b.y_off[bump] = 0
+    traj_a.collided[bump] = True
+    traj_b.collided[bump] = True
+
+    rear_end(same_block & any_player_lizards)
+
+def _calc_path_mods(batch, players, traj, lizarding):
+    mods = _Mods(len(players))
+    moved, start, end = traj.path(players, lizarding)
+
+    for k in range(_MAX_PATH + 1):
+        _, active, blocks = _path_blocks(batch, players, traj, moved, start,
+                                         end, k)
+        if not active.any():
+            break
+
+        slow = active & ((blocks == RawBlock.MUD) |
+                         (blocks == RawBlock.OIL_SPILL))
+        slow_down = slow & (traj.speed > Speed.SPEED_1.value)
+        traj.speed[slow_down] = _PREV_SPEED[traj.damage[slow_down],
+                                            traj.speed[slow_down]]
+        mods.penalise(active & (blocks == RawBlock.MUD), 3, 1)
+        mods.penalise(active & (blocks == RawBlock.OIL_SPILL), 4, 1)
+
+        wall = active & (blocks == RawBlock.WALL)
+        traj.speed[wall] = Speed.SPEED_1.value
+        mods.penalise(wall, 5, 2)
+
+        for block, count in [(RawBlock.OIL_ITEM, mods.oils),
+                             (RawBlock.BOOST, mods.boosts),
+                             (RawBlock.LIZARD, mods.lizards),
+                             (RawBlock.TWEET, mods.tweets),
+                             (RawBlock.EMP, mods.emps)]:
+            pickup = active & (blocks == block)
+            count[pickup] += 1
+            mods.score[pickup] += 4
+
+    return mods
+
+def _apply_traj(players, traj):
+    players.x += traj.x_off
+    players.y += traj.y_off
+    players.speed = traj.speed.copy()
+
+def _decel_boost_cancel(players, cmds):
+    cancel = players.boosting & (cmds == DECEL)
+    players.boosting[cancel] = False
+    players.boost_counter[cancel] = 0
+
+def _cap_speed(players):
+    cap = ~players.boosting
+    players.speed[cap] = np.minimum(_MAX_SPEED[players.damage[cap]],
+                                    players.speed[cap])
+
+# the vectorized equivalent of state.next_state. cmds and opp_cmds are arrays
+# of cmd codes (see encode_cmds) and are assumed to be valid movement cmds.
+# returns a new batch
+def next_state_batch(batch, cmds, opp_cmds):
+    nbatch = StateBatch.__new__(StateBatch)
+    nbatch.map = batch.map
+    nbatch.lanes = batch.lanes
+    nbatch.player = player = batch.player.copy()
+    nbatch.opponent = opp = batch.opponent.copy()
+
+    cmds = np.asarray(cmds)
+    opp_cmds = np.asarray(opp_cmds)
+    lizarding = cmds == LIZARD
+    opp_lizarding = opp_cmds == LIZARD
+
+    ## keep track of boosting counters
+    _count_boosting(player)
+    _count_boosting(opp)
+
+    ## calculate trajectories
+    player_traj = _Traj(player, cmds)
+    opp_traj = _Traj(opp, opp_cmds)
+
+    ## check fixes
+    _check_fix(player, cmds)
+    _check_fix(opp, opp_cmds)
+
+    ## check for powerups that were used and consume them
+    _track_powerups(player, cmds)
+    _track_powerups(opp, opp_cmds)
+
+    ## check for cybertruck collisions
+    player_cyber_mods, player_ct_x, player_ct_y = \
+        _resolve_cybertruck_collisions(batch, player, player_traj, lizarding)
+    opp_cyber_mods, opp_ct_x, opp_ct_y = \
+        _resolve_cybertruck_collisions(batch, opp, opp_traj, opp_lizarding)
+
+    player_cyber_mods.apply(player)
+    opp_cyber_mods.apply(opp)
+
+    ## check for collisions
+    _check_collisions(player, opp, player_traj, opp_traj, lizarding,
+                      opp_lizarding)
+
+    ## check players' path for penalties and powerups
+    player_mods = _calc_path_mods(batch, player, player_traj, lizarding)
+    opp_mods = _calc_path_mods(batch, opp, opp_traj, opp_lizarding)
+
+    ## apply trajectories and mods
+    _apply_traj(player, player_traj)
+    _apply_traj(opp, opp_traj)
+
+    player_mods.apply(player)
+    opp_mods.apply(opp)
+
+    ## check if boosting was cancelled by decelerating
+    _decel_boost_cancel(player, cmds)
+    _decel_boost_cancel(opp, opp_cmds)
+
+    ## keep track of cybertruck collisions
+    nbatch.consumed = []
+    for i, consumed in enumerate(batch.consumed):
+        consumed = list(consumed)
+        if player_ct_x[i]:
+            consumed.append((player_ct_x[i].item(), player_ct_y[i].item()))
+        if opp_ct_x[i]:
+            consumed.append((opp_ct_x[i].item(), opp_ct_y[i].item()))
+        nbatch.consumed.append(tuple(consumed))
+
+    ## cap speed after damage
+    _cap_speed(player)
+    _cap_speed(opp)
+
+    return nbatch
@@ -1,20 +1,26 @@
 import json
 import os
+import time
 from collections import deque
-from functools import lru_cache
 
 from sloth.enums import Cmd, Block, boost_speed
 from sloth.state import State, Player, StateTransition, calc_opp_cmd, next_state
+from sloth.state import next_player, walk_segment, collision_stats
+from sloth.state import intern_state, intern_player
+from sloth.state import set_engine
 from sloth.state import ns_filter
-from sloth.maps import Map, GlobalMap, clean_map
-from sloth.search import search, offensive_search, score, Weights, opp_search
+from sloth.maps import Map, CompactGlobalMap, clean_map
+from sloth.cache import bounded_cache, DEFAULT_MAXSIZE
+from sloth.search import dfs_search, offensive_search, score, Weights
+from sloth.search import opp_search, search_stats, SearchTimeout
+from sloth.search import beam_search
 # from sloth.ensemble import Ensemble
 from sloth.log import log
 
 class Bot:
     def __init__(self):
         self.finished = False
-        self.global_map = GlobalMap(x_size=1500, y_size=4)
+        self.global_map = CompactGlobalMap(x_size=1500, y_size=4)
 
         self.prev_state = None
         self.state = None
@@ -23,9 +29,46 @@ class Bot:
         self.backlog = deque()
 
         with open('weights.json', 'r') as f:
-            self.weights = Weights(json.load(f))
+            config = json.load(f)
+        self.weights = Weights(config)
         self.opp_weights = self.weights
 
+        # maximum amount of entries each of the simulation caches may hold
+        cache_size = config.get('cache_size', DEFAULT_MAXSIZE)
+        for cache in self.caches().values():
+            cache.resize(cache_size)
+
+        # engine used by the simulation, falls back to python if it isn't
+        # available
+        engine = set_engine(config.get('engine', 'python'))
+        log.info(f'using the {engine} engine')
+
+        # merges action sequences that reach the same state during the search.
+        # off by default since the merged subtrees are mostly next_state cache
+        # hits anyway
+        self.transpositions = config.get('transpositions', False)
+        # drops search nodes that are dominated by a sibling under the weights
+        self.dominance = config.get('dominance', False)
+
+        # seconds that each round may take, counted from when the round number
+        # is received. if set the movement search deepens one ply at a time,
+        # up to max_search_depth, until search_share of the budget is used up
+        # instead of using a fixed search depth. the rest is left for the
+        # offensive search
+        self.time_budget = config.get('time_budget', None)
+        self.search_share = config.get('search_share', 0.8)
+        self.max_search_depth = config.get('max_search_depth', 8)
+        self.round_start = time.monotonic()
+        # deadline of the running search, also applied to opponent predictions
+        self.deadline = None
+
+        # if set, a beam search keeping this many options per ply is used
+        # where the view leaves room to look further than the full search, so
+        # that the search can look up to beam_depth plies ahead
+        self.beam_width = config.get('beam_width', None)
+        self.beam_depth = config.get('beam_depth', 6)
+        self.beam_per_lane = config.get('beam_per_lane', True)
+
         # self.ensemble = Ensemble(size=1000)
 
         self.search_depth = 3
@@ -111,9 +154,10 @@ class Bot:
         opp.lizards = max(opp.lizards, 0)
         opp.boosts = max(opp.boosts, 0)
 
-        # remove crashed into cybertrucks
+        # remove crashed into cybertrucks. calc_ns is shared by the next_state
+        # cache, so its map is copied before writing the changes out
         if trans.from_state.opponent.x < trans.from_state.player.x:
-            calc_ns.map.update_global_map()
+            calc_ns.map.copy().update_global_map()
 
         # score ensemble and choose new opponent weights
         # self.ensemble.update_scores(trans.from_state, cmd)
@@ -131,7 +175,7 @@ class Bot:
 
     # predicts the opponent's move based on the given state
     # NOTE only predicts movement and not offensive actions
-    @lru_cache(maxsize=None)
+    @bounded_cache()
     def _pred_opp(self, state, search_depth):
         if search_depth == 0:
             return Cmd.ACCEL
@@ -147,9 +191,74 @@ class Bot:
             state.opponent.y) and state.opponent.speed == 0):
             return Cmd.NOP
 
-        return score(opp_search(state, max_search_depth=search_depth),
+        return score(opp_search(state, max_search_depth=search_depth,
+                                deadline=self.deadline),
                      state.switch(), self.opp_weights)[0]
 
+    # returns the caches used during the search, keyed by name
+    def caches(self):
+        return {
+            'next_state': next_state,
+            'next_player': next_player,
+            'walk_segment': walk_segment,
+            'pred_opp': Bot._pred_opp,
+            'intern_state': intern_state,
+            'intern_player': intern_player,
+        }
+
+    # logs the caches' hit, miss and eviction counts
+    def log_caches(self, round_num):
+        for name, cache in self.caches().items():
+            log.info(f'round {round_num} {name} cache: {cache.cache_info()}')
+        log.info(f'round {round_num} collisions: {dict(collision_stats)}')
+        log.info(f'round {round_num} search: {dict(search_stats)}')
+
+    # does a movement search up to the given depth and returns the best
+    # scoring cmds. raises SearchTimeout if the deadline passes
+    def search_cmds(self, depth, deadline=None):
+        self.deadline = deadline
+        # score weighs the first action's state as well, so only sequences with
+        # the same first action may be merged
+        split_first = bool(self.weights.next_state)
+        prune = self.weights if self.dominance else None
+        search_res = dfs_search(self.state, self.pred_opp,
+                                max_search_depth=depth,
+                                transpositions=self.transpositions,
+                                split_first=split_first, prune=prune,
+                                deadline=deadline)
+        return score(search_res, self.state, self.weights, self.pred_opp)
+
+    # does a beam search up to the given depth and returns the best scoring
+    # cmds
+    def beam_cmds(self, depth):
+        search_res = beam_search(self.state, self.pred_opp, depth, self.weights,
+                                 width=self.beam_width,
+                                 per_lane=self.beam_per_lane)
+        return score(search_res, self.state, self.weights, self.pred_opp)
+
+    # searches one ply deeper at a time until the deadline passes and returns
+    # the best cmds of the deepest search that completed. the first ply is
+    # always completed so that there is something to return
+    def deepen(self, deadline):
+        cmds = self.search_cmds(1)
+
+        for depth in range(2, self.max_search_depth + 1):
+            if time.monotonic() > deadline:
+                break
+            try:
+                deeper = self.search_cmds(depth, deadline)
+            except SearchTimeout:
+                break
+            cmds = deeper
+            # the search stops at the depth where it leaves the view, so
+            # searching any deeper won't change the result
+            if len(cmds) < depth:
+                break
+
+        self.search_depth = len(cmds)
+        log.info(f'searched {self.search_depth} plies deep')
+        return cmds
+
     # returns the cmd that should be executed given the current state
     # done by doing a search for the best move
     def calc_cmd(self):
@@ -163,16 +272,31 @@ class Bot:
             self.search_depth = 3
             self.opp_search_depth = 2
 
-        search_res = search(self.state, self.pred_opp,
-                            max_search_depth=self.search_depth)
-        cmds = score(search_res, self.state, self.weights, self.pred_opp)
+        # the search stops where it leaves the view, so the beam can only look
+        # further ahead if the full search doesn't reach the end of the view
+        room = self.state.map.max_x - self.state.player.x
+        if (self.beam_width and
+                room > self.search_depth * self.state.player.speed):
+            cmds = self.beam_cmds(self.beam_depth)
+            self.search_depth = len(cmds)
+        elif self.time_budget is None:
+            cmds = self.search_cmds(self.search_depth)
+        else:
+            cmds = self.deepen(self.round_start +
+                               self.time_budget * self.search_share)
         cmd = cmds[0]
 
         if cmd == Cmd.NOP:
             # increase search depth for better opponent prediction in offensive
             # search
             self.opp_search_depth = 3
-            cmd = offensive_search(self.state, cmds, self.pred_opp)
+            self.deadline = None
+            if self.time_budget is not None:
+                self.deadline = self.round_start + self.time_budget
+            try:
+                cmd = offensive_search(self.state, cmds, self.pred_opp)
+            except SearchTimeout:
+                log.info('offensive search ran out of time')
 
             # place oil block on map if we're dropping oil
             if cmd == Cmd.OIL:
@@ -190,10 +314,14 @@ class Bot:
 
             if round_num < 0:
                 break
+            self.round_start = time.monotonic()
+            self.deadline = None
 
             # clear caches
-            self._pred_opp.cache_clear()
-            next_state.cache_clear()
+            for cache in self.caches().values():
+                cache.cache_clear()
+            collision_stats.clear()
+            search_stats.clear()
 
             # read the state file
             raw_state = self.read_state(round_num)
@@ -210,9 +338,13 @@ class Bot:
                     self.state.map.global_map[x, y] = block
                 # place new cybertruck
                 x, y = self.prev_cmd.pos
-                self.state.map.global_map[x, y].set_cybertruck()
+                self.state.map.global_map.set_cybertruck(x, y)
                 self.ct_pos = (x, y)
 
+            # lets the search know which cybertruck to remove if we tweet again
+            if self.ct_pos is not None:
+                self.state.map.cybertrucks = {self.state.player.id: self.ct_pos}
+
             # check if game is finished
             if self.finished:
                 break
@@ -223,3 +355,5 @@ class Bot:
 
             # execute next cmd
             self.exec(round_num, cmd)
+
+            self.log_caches(round_num)
@@ -0,0 +1,73 @@
+import functools
+import types
+from collections import OrderedDict, namedtuple
+
+# default amount of entries a cache may hold before it starts evicting
+DEFAULT_MAXSIZE = 200000
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'maxsize',
+                                     'currsize'])
+
+# memoizes a function's results up to maxsize entries, evicting the least
+# recently used entry once it is full. only positional arguments are supported.
+# works like functools.lru_cache but keeps track of evictions and can be
+# resized. if given, key is called with the arguments to calculate the cache
+# key, otherwise the arguments themselves are used
+class BoundedCache:
+    def __init__(self, func, maxsize=DEFAULT_MAXSIZE, key=None):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.maxsize = maxsize
+        self.key = key
+        self.cache = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, *args):
+        key = args if self.key is None else self.key(*args)
+        try:
+            result = self.cache[key]
+        except KeyError:
+            self.misses += 1
+            result = self.func(*args)
+            self.cache[key] = result
+            if len(self.cache) > self.maxsize:
+                self.cache.popitem(last=False)
+                self.evictions += 1
+            return result
+
+        self.hits += 1
+        self.cache.move_to_end(key)
+        return result
+
+    # allows decorating methods
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return types.MethodType(self, obj)
+
+    # changes the maximum amount of entries, evicting entries if needed
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    def cache_info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize,
+                         len(self.cache))
+
+    # clears the cache's entries and statistics
+    def cache_clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+# decorator version of BoundedCache
+def bounded_cache(maxsize=DEFAULT_MAXSIZE, key=None):
+    def decorator(func):
+        return BoundedCache(func, maxsize, key)
+    return decorator
@@ -14,6 +14,14 @@ class Block(enum.Enum):
 
     CYBERTRUCK = 100
 
+# raw integer block codes for hot loops that work with Map.raw instead of
+# BlockOverlay objects
+class RawBlock:
+    pass
+
+for block in Block:
+    setattr(RawBlock, block.name, block.value)
+
 class Speed(enum.Enum):
     MIN_SPEED = 0
     SPEED_1 = 3
@@ -41,61 +49,117 @@ MAX_SPEED_STEPS = [
     Speed.MIN_SPEED.value,
 ]
 
-def max_speed(damage):
+# speeds and damage levels covered by the lookup tables below. damage is capped
+# at 5 by the game engine
+TABLE_SPEEDS = range(Speed.BOOST_SPEED.value + 1)
+TABLE_DAMAGES = range(6)
+
+def _calc_max_speed(damage):
     return MAX_SPEED_STEPS[max(1, min(damage, 5))]
 
-def boost_speed(damage):
+def _calc_boost_speed(damage):
     return MAX_SPEED_STEPS[max(0, min(damage, 5))]
 
-def next_speed(speed, damage=0):
-    m = max_speed(damage)
+def _calc_next_speed(speed, damage):
+    m = _calc_max_speed(damage)
     try:
         return next(s for s in SPEED_STEPS if s > speed and s <= m)
     except StopIteration:
         return m
 
-def prev_speed(speed, damage=0):
-    m = max_speed(damage)
+def _calc_prev_speed(speed, damage):
+    m = _calc_max_speed(damage)
     try:
         return next(s for s in SPEED_STEPS[::-1] if s < speed and s <= m)
     except StopIteration:
         return SPEED_STEPS[0]
 
+# speed lookup tables, indexed by damage and then by speed (e.g.
+# NEXT_SPEED[damage][speed])
+MAX_SPEED = [_calc_max_speed(d) for d in TABLE_DAMAGES]
+BOOST_SPEED = [_calc_boost_speed(d) for d in TABLE_DAMAGES]
+NEXT_SPEED = [[_calc_next_speed(s, d) for s in TABLE_SPEEDS] for d in
+              TABLE_DAMAGES]
+PREV_SPEED = [[_calc_prev_speed(s, d) for s in TABLE_SPEEDS] for d in
+              TABLE_DAMAGES]
+
+def max_speed(damage):
+    return MAX_SPEED[max(0, min(damage, 5))]
+
+def boost_speed(damage):
+    return BOOST_SPEED[max(0, min(damage, 5))]
+
+def next_speed(speed, damage=0):
+    if 0 <= speed <= Speed.BOOST_SPEED.value:
+        return NEXT_SPEED[max(0, min(damage, 5))][speed]
+    return _calc_next_speed(speed, damage)
+
+def prev_speed(speed, damage=0):
+    if 0 <= speed <= Speed.BOOST_SPEED.value:
+        return PREV_SPEED[max(0, min(damage, 5))][speed]
+    return _calc_prev_speed(speed, damage)
+
 class Cmd:
-    class CmdEnum(enum.Enum):
-        NOP = 'NOTHING'
-
-        ACCEL = 'ACCELERATE'
-        DECEL = 'DECELERATE'
-        LEFT = 'TURN_LEFT'
-        RIGHT = 'TURN_RIGHT'
-        BOOST = 'USE_BOOST'
-        OIL = 'USE_OIL'
-        LIZARD = 'USE_LIZARD'
-        TWEET = 'USE_TWEET'
-        EMP = 'USE_EMP'
-        FIX = 'FIX'
-
-    def __init__(self, cmd, pos=None):
-        if type(cmd) is Cmd.CmdEnum:
-            self.cmd = cmd
-        elif type(cmd) is Cmd:
-            self.cmd = cmd.cmd
+    # commands are small integer opcodes so that comparing and hashing them in
+    # the simulation is a single int operation. they only get converted to the
+    # game's command strings when they are executed (see CMD_STRINGS)
+    class CmdEnum(enum.IntEnum):
+        NOP = 0
+
+        ACCEL = 1
+        DECEL = 2
+        LEFT = 3
+        RIGHT = 4
+        BOOST = 5
+        OIL = 6
+        LIZARD = 7
+        TWEET = 8
+        EMP = 9
+        FIX = 10
+
+    # interned instances, keyed by (cmd, pos)
+    _interned = {}
+
+    # Cmd instances are interned, so creating the same command twice returns
+    # the same object
+    def __new__(cls, cmd, pos=None):
+        if type(cmd) is Cmd:
+            cmd = cmd.cmd
+        elif type(cmd) is str:
+            cmd = CMD_OPCODES[cmd]
         else:
-            self.cmd = Cmd.CmdEnum(cmd)
+            cmd = Cmd.CmdEnum(cmd)
+
+        try:
+            return Cmd._interned[cmd, pos]
+        except KeyError:
+            pass
 
-        self.pos = pos
+        obj = super().__new__(cls)
+        obj.cmd = cmd
+        obj.pos = pos
+        Cmd._interned[cmd, pos] = obj
+        return obj
 
     def __eq__(self, other):
-        if type(other) is Cmd.CmdEnum:
-            return self.cmd == other
+        if other is self:
+            return True
         elif type(other) is Cmd:
             return (self.cmd, self.pos) == (other.cmd, other.pos)
+        elif isinstance(other, int):
+            return self.cmd == other
         raise ValueError(f'unsupported type {type(other)} for operand ==')
 
     def __hash__(self):
         return hash((self.cmd, self.pos))
 
+    # allows cmds to index tables by opcode
+    def __index__(self):
+        return int(self.cmd)
+
+    def __int__(self):
+        return int(self.cmd)
+
     def __repr__(self):
         if self.pos is None:
             return repr(self.cmd)
@@ -104,9 +168,27 @@ class Cmd:
 
     def __str__(self):
         if self.pos is None:
-            return str(self.cmd.value)
+            return CMD_STRINGS[self.cmd]
         else:
-            return f'{self.cmd.value} {self.pos[1]} {self.pos[0]}'
+            return f'{CMD_STRINGS[self.cmd]} {self.pos[1]} {self.pos[0]}'
 
 for cmd in Cmd.CmdEnum:
     setattr(Cmd, cmd.name, cmd)
+
+# the game's command strings for each opcode
+CMD_STRINGS = {
+    Cmd.NOP: 'NOTHING',
+
+    Cmd.ACCEL: 'ACCELERATE',
+    Cmd.DECEL: 'DECELERATE',
+    Cmd.LEFT: 'TURN_LEFT',
+    Cmd.RIGHT: 'TURN_RIGHT',
+    Cmd.BOOST: 'USE_BOOST',
+    Cmd.OIL: 'USE_OIL',
+    Cmd.LIZARD: 'USE_LIZARD',
+    Cmd.TWEET: 'USE_TWEET',
+    Cmd.EMP: 'USE_EMP',
+    Cmd.FIX: 'FIX',
+}
+
+CMD_OPCODES = {string: cmd for cmd, string in CMD_STRINGS.items()}
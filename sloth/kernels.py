@@ -0,0 +1,158 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from sloth.enums import RawBlock, Speed, PREV_SPEED
+from sloth.cache import bounded_cache
+from sloth import batch
+
+# flat-array versions of the inner simulation functions in sloth.state, used by
+# its numba engine (see state.set_engine). the kernels only take ints and int
+# arrays, so numba can compile them. without numba they run as plain python and
+# give the same results, just slower
+
+# whether the kernels are compiled
+JIT = numba is not None
+
+# compiles the kernel with numba if it's installed. the compiled code isn't
+# cached on disk, since numba would write the cache into the package directory
+def kernel(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=False)(func)
+
+# numba needs the tables as arrays. uncompiled kernels use the lists so that
+# they return plain ints
+def table(values):
+    if numba is None:
+        return values
+    return np.array(values, dtype=np.int64)
+
+# numba can't look up class attributes, so the constants are copied to globals
+EMPTY = RawBlock.EMPTY
+MUD = RawBlock.MUD
+OIL_SPILL = RawBlock.OIL_SPILL
+OIL_ITEM = RawBlock.OIL_ITEM
+FINISH_LINE = RawBlock.FINISH_LINE
+BOOST = RawBlock.BOOST
+WALL = RawBlock.WALL
+LIZARD = RawBlock.LIZARD
+TWEET = RawBlock.TWEET
+EMP = RawBlock.EMP
+CYBERTRUCK = RawBlock.CYBERTRUCK
+
+# matches all the blocks that affect a player, like BlockIndex.ACTIVE
+ACTIVE = -1
+
+SPEED_1 = Speed.SPEED_1.value
+
+_PREV_SPEED = table(PREV_SPEED)
+
+# the raw block codes of each lane of the map (including its view) as arrays,
+# where lanes[y - 1][x - 1] holds the block at x, y (see batch.map_lanes).
+# cached per version of the global map and of the view, so they're only built
+# once for each of them
+@bounded_cache(maxsize=64, key=lambda state_map: (
+    state_map.global_map.version, state_map.version))
+def map_lanes(state_map):
+    return list(batch.map_lanes(state_map))
+
+# index of the first block with the given code between i1 and i2 (exclusive)
+# in the lane, or -1 if there isn't one
+@kernel
+def first_block(lane, i1, i2, code):
+    for i in range(i1, i2):
+        block = lane[i]
+        if block == code:
+            return i
+        if code == ACTIVE and block != EMPTY and block != FINISH_LINE:
+            return i
+    return -1
+
+# see state.walk_segment. walks the blocks between i1 and i2 (exclusive) in the
+# lane
+@kernel
+def walk_blocks(lane, i1, i2, speed, damage):
+    oils = boosts = lizards = tweets = emps = 0
+    penalties = damage_taken = score = 0
+
+    for i in range(i1, i2):
+        block = lane[i]
+
+        if block == MUD or block == OIL_SPILL:
+            if speed > SPEED_1:
+                speed = _PREV_SPEED[damage][speed]
+            penalties += 1
+            damage_taken += 1
+            score -= 3 if block == MUD else 4
+        elif block == WALL:
+            speed = SPEED_1
+            penalties += 1
+            damage_taken += 2
+            score -= 5
+        elif block == OIL_ITEM:
+            oils += 1
+            score += 4
+        elif block == BOOST:
+            boosts += 1
+            score += 4
+        elif block == LIZARD:
+            lizards += 1
+            score += 4
+        elif block == TWEET:
+            tweets += 1
+            score += 4
+        elif block == EMP:
+            emps += 1
+            score += 4
+
+    return (speed, oils, boosts, lizards, tweets, emps, penalties,
+            damage_taken, score)
+
+# see state.check_collisions. returns the new x_off, y_off and collided flag of
+# both trajectories
+@kernel
+def collide(a_x, a_y, a_x_off, a_y_off, a_collided, a_lizarding, b_x, b_y,
+            b_x_off, b_y_off, b_collided, b_lizarding):
+    started_same_lane = a_y == b_y
+    ended_same_lane = a_y_off == b_y_off
+    a_started_ahead = a_x > b_x
+    any_player_lizards = a_lizarding or b_lizarding
+    a_ended_ahead = a_x + a_x_off > b_x + b_x_off
+    b_ended_ahead = b_x + b_x_off > a_x + a_x_off
+
+    if a_ended_ahead == b_ended_ahead:
+        a_ended_ahead = not a_started_ahead
+
+    drove_through = a_started_ahead != a_ended_ahead and not any_player_lizards
+
+    if started_same_lane and ended_same_lane and drove_through:
+        if a_started_ahead:
+            b_x_off = a_x + a_x_off - 1 - b_x
+            b_collided = True
+        else:
+            a_x_off = b_x + b_x_off - 1 - a_x
+            a_collided = True
+
+    x_same = a_x + a_x_off == b_x + b_x_off
+    y_same = a_y + a_y_off == b_y + b_y_off
+
+    if x_same and y_same:
+        if not any_player_lizards:
+            a_x_off -= 1
+            b_x_off -= 1
+            a_y_off = 0
+            b_y_off = 0
+            a_collided = True
+            b_collided = True
+        elif a_started_ahead:
+            b_x_off = a_x + a_x_off - 1 - b_x
+            b_collided = True
+        else:
+            a_x_off = b_x + b_x_off - 1 - a_x
+            a_collided = True
+
+    return a_x_off, a_y_off, a_collided, b_x_off, b_y_off, b_collided
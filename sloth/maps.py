@@ -1,8 +1,36 @@
-import copy
+import itertools
+import struct
 
-from sloth.enums import Block
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # only available from python 3.8
+    shared_memory = None
+
+from sloth import zobrist
+from sloth.enums import Block, RawBlock
+
+# map versions are unique across all maps, so a version identifies both a map
+# and its contents. used to key caches that depend on a map's contents
+_versions = itertools.count(1)
+
+def next_version():
+    return next(_versions)
+
+# version of all views without any changes
+EMPTY_VIEW_VERSION = 0
+
+# raw codes of the blocks that damage or slow down a player
+BAD_BLOCKS = (RawBlock.MUD, RawBlock.WALL, RawBlock.OIL_SPILL,
+              RawBlock.CYBERTRUCK)
 
 class BlockOverlay:
+    # the global map (and position in it) that holds this block, if any. the
+    # global map gets notified of cybertrucks being placed so that it can keep
+    # its index up to date
+    owner = None
+    pos = None
+
     def __init__(self, block):
         if type(block) is Block:
             self.block = block
@@ -15,11 +43,13 @@ class BlockOverlay:
             self.overlay = None
 
     def bad_block(self):
-        return self.get_block() in [Block.MUD, Block.WALL, Block.OIL_SPILL,
-                                    Block.CYBERTRUCK]
+        return self.raw() in BAD_BLOCKS
 
     def set_cybertruck(self):
+        old = self.raw()
         self.overlay = Block.CYBERTRUCK
+        if self.owner is not None:
+            self.owner.block_changed(*self.pos, old, self.raw())
 
     def get_block(self):
         if self.overlay is not None:
@@ -29,6 +59,10 @@ class BlockOverlay:
     def get_underlay(self):
         return self.block
 
+    # returns the raw integer code of the visible block
+    def raw(self):
+        return self.get_block().value
+
     def __hash__(self):
         return hash(self.get_block())
 
@@ -49,22 +83,114 @@ class BlockOverlay:
     def __str__(self):
         return repr(self)
 
+# keeps per-lane cumulative counts of each type of block in a global map, which
+# allows counting the blocks between two positions and finding the next block
+# of a type in O(log n). counts are stored in fenwick trees, one per lane and
+# raw block code. x and y are 1-indexed like the global map
+class BlockIndex:
+    # key of the trees that count all the blocks that affect a player driving
+    # over them (i.e. everything except empty blocks and the finish line)
+    ACTIVE = -1
+    INERT = (RawBlock.EMPTY, RawBlock.FINISH_LINE)
+
+    def __init__(self, x_size, y_size):
+        self.size = x_size
+        # trees are created as soon as a block of its type gets added
+        self.trees = {}
+
+    def _add(self, y, code, x, delta):
+        tree = self.trees.get((y, code))
+        if tree is None:
+            tree = self.trees[y, code] = [0] * (self.size + 1)
+        while x <= self.size:
+            tree[x] += delta
+            x += x & -x
+
+    @staticmethod
+    def _prefix(tree, x):
+        total = 0
+        while x > 0:
+            total += tree[x]
+            x -= x & -x
+        return total
+
+    # records that the block at x, y changed from the old to the new raw code
+    def update(self, x, y, old, new):
+        if old == new:
+            return
+        for code, delta in [(old, -1), (new, 1)]:
+            if code != RawBlock.EMPTY:
+                self._add(y, code, x, delta)
+            if code not in BlockIndex.INERT:
+                self._add(y, BlockIndex.ACTIVE, x, delta)
+
+    # returns the amount of blocks with the given raw code between x1 and x2
+    # (inclusive) in lane y
+    def count(self, y, x1, x2, code=ACTIVE):
+        tree = self.trees.get((y, code))
+        x1, x2 = max(x1, 1), min(x2, self.size)
+        if tree is None or x2 < x1:
+            return 0
+        return self._prefix(tree, x2) - self._prefix(tree, x1 - 1)
+
+    # returns the x of the first block with the given raw code in lane y at or
+    # after x (and at or before end if given), or None if there isn't one
+    def first(self, y, x, code=ACTIVE, end=None):
+        tree = self.trees.get((y, code))
+        end = self.size if end is None else min(end, self.size)
+        if tree is None or x > end:
+            return None
+
+        before = self._prefix(tree, max(x, 1) - 1)
+        if self._prefix(tree, end) == before:
+            return None
+
+        # find the smallest position whose prefix count exceeds the count
+        # before x by walking down the tree
+        target = before + 1
+        pos = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nxt = pos + step
+            if nxt <= self.size and tree[nxt] < target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+
+        return pos + 1 if pos < self.size else None
+
 class GlobalMap:
     def __init__(self, x_size, y_size):
         # map dimensions are flipped since generally y << x - this leads to
         # better memory efficiency since we have a few long lists compared to
         # many small lists. will still be x, y in get_item
-        self.map = [[BlockOverlay(Block.EMPTY) for _ in range(x_size)] for _ in
-                    range(y_size)]
+        self.map = [[self._own(BlockOverlay(Block.EMPTY), x, y) for x in
+                     range(1, x_size + 1)] for y in range(1, y_size + 1)]
         self.min_x, self.min_y = 1, 1
         self.max_x, self.max_y = x_size, y_size
+        self.index = BlockIndex(x_size, y_size)
+        self.version = next_version()
+
+    # updates the index and version after the block at x, y changed
+    def block_changed(self, x, y, old, new):
+        self.index.update(x, y, old, new)
+        self.version = next_version()
+
+    # marks a block as being stored in this map at x, y
+    def _own(self, block, x, y):
+        block.owner = self
+        block.pos = (x, y)
+        return block
 
     # x and y are 1-indexed to be compatible with game format
     def __setitem__(self, idx, val):
         x, y = idx
         if self.min_x <= x <= self.max_x:
             if self.min_y <= y <= self.max_y:
-                self.map[y - self.min_y][x - self.min_x] = BlockOverlay(val)
+                old = self.map[y - self.min_y][x - self.min_x]
+                block = self._own(BlockOverlay(val), x, y)
+                self.map[y - self.min_y][x - self.min_x] = block
+                self.block_changed(x, y, old.raw(), block.raw())
                 return
         raise IndexError
 
@@ -76,13 +202,259 @@ class GlobalMap:
                 return self.map[y - self.min_y][x - self.min_x]
         raise IndexError
 
+    # returns the raw integer code of the visible block at x, y
+    def raw(self, x, y):
+        return self[x, y].raw()
+
+    # returns the raw codes of the blocks between x1 and x2 (inclusive) in lane
+    # y
+    def raw_lane(self, y, x1, x2):
+        return [self[x, y].raw() for x in range(x1, x2 + 1)]
+
+    # places a cybertruck on top of the block at x, y
+    def set_cybertruck(self, x, y):
+        self[x, y].set_cybertruck()
+
+# alternative global map that stores the raw block codes of each lane in a
+# bytearray with a separate bitset per lane for the cybertruck overlays. avoids
+# allocating a BlockOverlay for every block, use raw() in hot loops
+class CompactGlobalMap:
+    def __init__(self, x_size, y_size):
+        self.lanes = [bytearray(x_size) for _ in range(y_size)]
+        self.trucks = [bytearray((x_size + 7) // 8) for _ in range(y_size)]
+        self.min_x, self.min_y = 1, 1
+        self.max_x, self.max_y = x_size, y_size
+        self.index = BlockIndex(x_size, y_size)
+        self.version = next_version()
+
+    # updates the index and version after the block at x, y changed
+    def block_changed(self, x, y, old, new):
+        self.index.update(x, y, old, new)
+        self.version = next_version()
+
+    # x and y are 1-indexed to be compatible with game format
+    def __setitem__(self, idx, val):
+        x, y = idx
+        if self.min_x <= x <= self.max_x:
+            if self.min_y <= y <= self.max_y:
+                block = BlockOverlay(val)
+                old = self.raw(x, y)
+                i = x - self.min_x
+                self.lanes[y - self.min_y][i] = block.block.value
+                if block.overlay is None:
+                    self.trucks[y - self.min_y][i >> 3] &= ~(1 << (i & 7))
+                else:
+                    self.trucks[y - self.min_y][i >> 3] |= 1 << (i & 7)
+                self.block_changed(x, y, old, block.raw())
+                return
+        raise IndexError
+
+    # x and y are 1-indexed to be compatible with game format. returns a new
+    # BlockOverlay, so changes to it won't be reflected in the map (use
+    # set_cybertruck instead)
+    def __getitem__(self, idx):
+        x, y = idx
+        if self.min_x <= x <= self.max_x:
+            if self.min_y <= y <= self.max_y:
+                i = x - self.min_x
+                block = BlockOverlay(Block(self.lanes[y - self.min_y][i]))
+                if self.trucks[y - self.min_y][i >> 3] & (1 << (i & 7)):
+                    block.set_cybertruck()
+                return block
+        raise IndexError
+
+    # returns the raw integer code of the visible block at x, y
+    def raw(self, x, y):
+        if self.min_x <= x <= self.max_x:
+            if self.min_y <= y <= self.max_y:
+                i = x - self.min_x
+                if self.trucks[y - self.min_y][i >> 3] & (1 << (i & 7)):
+                    return RawBlock.CYBERTRUCK
+                return self.lanes[y - self.min_y][i]
+        raise IndexError
+
+    # returns the raw codes of the blocks between x1 and x2 (inclusive) in lane
+    # y
+    def raw_lane(self, y, x1, x2):
+        if x1 > x2:
+            return []
+        if not (self.min_x <= x1 and x2 <= self.max_x and
+                self.min_y <= y <= self.max_y):
+            raise IndexError
+
+        i1, i2 = x1 - self.min_x, x2 - self.min_x
+        codes = list(self.lanes[y - self.min_y][i1:i2 + 1])
+
+        # only look for cybertrucks if any of the bitset's bytes are set
+        trucks = self.trucks[y - self.min_y]
+        if any(trucks[i1 >> 3:(i2 >> 3) + 1]):
+            for i in range(i1, i2 + 1):
+                if trucks[i >> 3] & (1 << (i & 7)):
+                    codes[i - i1] = RawBlock.CYBERTRUCK
+        return codes
+
+    # places a cybertruck on top of the block at x, y
+    def set_cybertruck(self, x, y):
+        if self.min_x <= x <= self.max_x:
+            if self.min_y <= y <= self.max_y:
+                old = self.raw(x, y)
+                i = x - self.min_x
+                self.trucks[y - self.min_y][i >> 3] |= 1 << (i & 7)
+                self.block_changed(x, y, old, RawBlock.CYBERTRUCK)
+                return
+        raise IndexError
+
+# compact global map stored in a shared memory block, which lets other
+# processes attach to it by name without copying it. the owner creates the map
+# and updates it like any other global map, attached maps only read it. the
+# block starts with a header holding the map's version and size, followed by
+# the lanes and then the cybertruck bitsets. attached maps don't have an index
+# (maps fall back to scanning) and pickle as just the block's name
+class SharedGlobalMap(CompactGlobalMap):
+    HEADER = struct.Struct('<QHH')
+
+    def __init__(self, x_size, y_size, name=None):
+        if shared_memory is None:
+            raise RuntimeError('shared memory requires python 3.8 or later')
+
+        truck_size = (x_size + 7) // 8
+        size = SharedGlobalMap.HEADER.size + y_size * (x_size + truck_size)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        SharedGlobalMap.HEADER.pack_into(shm.buf, 0, 0, x_size, y_size)
+
+        self._setup(shm, x_size, y_size, attached=False)
+        self.index = BlockIndex(x_size, y_size)
+        self.version = next_version()
+
+    # attaches to the shared global map with the given name
+    @staticmethod
+    def attach(name):
+        if shared_memory is None:
+            raise RuntimeError('shared memory requires python 3.8 or later')
+
+        shm = shared_memory.SharedMemory(name=name)
+        _, x_size, y_size = SharedGlobalMap.HEADER.unpack_from(shm.buf)
+
+        gm = SharedGlobalMap.__new__(SharedGlobalMap)
+        gm._setup(shm, x_size, y_size, attached=True)
+        gm.index = None
+        return gm
+
+    # points the lanes and cybertruck bitsets at the shared memory block.
+    # attached maps get read-only views
+    def _setup(self, shm, x_size, y_size, attached):
+        self.shm = shm
+
+        truck_size = (x_size + 7) // 8
+        buf = shm.buf.toreadonly() if attached else shm.buf
+        offset = SharedGlobalMap.HEADER.size
+        self.lanes = []
+        for _ in range(y_size):
+            self.lanes.append(buf[offset:offset + x_size])
+            offset += x_size
+        self.trucks = []
+        for _ in range(y_size):
+            self.trucks.append(buf[offset:offset + truck_size])
+            offset += truck_size
+
+        self.min_x, self.min_y = 1, 1
+        self.max_x, self.max_y = x_size, y_size
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    # read from the shared block so that attached maps see the owner's changes
+    @property
+    def version(self):
+        return struct.unpack_from('<Q', self.shm.buf)[0]
+
+    @version.setter
+    def version(self, version):
+        struct.pack_into('<Q', self.shm.buf, 0, version)
+
+    # releases this process' view of the shared memory block
+    def close(self):
+        for view in self.lanes + self.trucks:
+            view.release()
+        self.lanes = []
+        self.trucks = []
+        self.shm.close()
+
+    # the lanes have to be released before the shared memory block can be
+    # closed, which the block would otherwise try to do first
+    def __del__(self):
+        if hasattr(self, 'shm'):
+            self.close()
+
+    # frees the shared memory block, only done by the owner once all the
+    # attached maps are closed
+    def unlink(self):
+        self.shm.unlink()
+
+    def __reduce__(self):
+        return (SharedGlobalMap.attach, (self.name,))
+
+# a frozen set of view writes that is shared between a map and its copies.
+# layers are never modified after creation, a map's own writes are kept
+# separately until it gets copied
+class ViewLayer:
+    __slots__ = ('writes', 'parent', 'depth', '_flat')
+
+    # chains longer than this get flattened into a single layer
+    MAX_DEPTH = 8
+
+    def __init__(self, writes, parent=None):
+        if parent is not None and parent.depth >= ViewLayer.MAX_DEPTH:
+            flat = dict(parent.flatten())
+            flat.update(writes)
+            writes, parent = flat, None
+
+        self.writes = writes
+        self.parent = parent
+        self.depth = 1 if parent is None else parent.depth + 1
+        self._flat = None
+
+    def get(self, pos, default=None):
+        layer = self
+        while layer is not None:
+            block = layer.writes.get(pos)
+            if block is not None:
+                return block
+            layer = layer.parent
+        return default
+
+    # returns all the writes in this layer and its parents. the result is
+    # cached and must not be modified
+    def flatten(self):
+        if self._flat is None:
+            if self.parent is None:
+                self._flat = self.writes
+            else:
+                self._flat = dict(self.parent.flatten())
+                self._flat.update(self.writes)
+        return self._flat
+
 class Map:
     def __init__(self, raw_map, global_map):
         # store global map
         self.global_map = global_map
 
-        # init mutable view
-        self.view = {}
+        # init copy-on-write view. writes are stored in _writes until the map
+        # is copied, after which they are frozen into a layer shared by the
+        # map and its copy
+        self._base = None
+        self._writes = {}
+
+        # zobrist hash of the view, kept up to date by __setitem__
+        self._hash = 0
+
+        # changes whenever the view changes
+        self.version = EMPTY_VIEW_VERSION
+
+        # position of the cybertruck each player placed, keyed by player id.
+        # replaced instead of modified so that it can be shared between copies
+        self.cybertrucks = {}
 
         # flatten raw_map dict
         raw_map = [w for row in raw_map for w in row]
@@ -100,32 +472,161 @@ class Map:
             global_map[x, y] = Block(w['surfaceObject'])
 
             if w.get('isOccupiedByCyberTruck', False):
-                global_map[x, y].set_cybertruck()
+                global_map.set_cybertruck(x, y)
 
             self.min_x = min(x, self.min_x)
             self.min_y = min(y, self.min_y)
             self.max_x = max(x, self.max_x)
             self.max_y = max(y, self.max_y)
 
+    # creates a map with the given window bounds and view changes, skipping
+    # parsing the raw map
+    @staticmethod
+    def from_view(global_map, min_x, max_x, min_y, max_y, view):
+        m = Map([], global_map)
+        m.min_x, m.max_x = min_x, max_x
+        m.min_y, m.max_y = min_y, max_y
+        for pos, block in view.items():
+            m[pos] = block
+        return m
+
+    # returns the view's changes relative to the global map. the result must
+    # not be modified
+    def _flat_view(self):
+        if self._base is None:
+            return self._writes
+        if not self._writes:
+            return self._base.flatten()
+        flat = dict(self._base.flatten())
+        flat.update(self._writes)
+        return flat
+
+    # the view's changes relative to the global map
+    @property
+    def view(self):
+        return dict(self._flat_view())
+
     # write view's changes to global map
     def update_global_map(self):
-        for pos in self.view:
-            self.global_map[pos] = self.view[pos]
-        self.view = {}
+        for pos, block in self._flat_view().items():
+            self.global_map[pos] = block
+        self._base = None
+        self._writes = {}
+        self._hash = 0
+        self.version = EMPTY_VIEW_VERSION
 
     # moves the min and max x bounds relative to two x positions
     def move_window(self, from_x, to_x):
         self.min_x = max(self.global_map.min_x, self.min_x + to_x - from_x)
         self.max_x = min(self.global_map.max_x, self.max_x + to_x - from_x)
 
+    # returns an O(1) copy of the map with its window moved (see move_window)
+    def window(self, from_x, to_x):
+        cm = self.copy()
+        cm.move_window(from_x, to_x)
+        return cm
+
     def __getitem__(self, pos):
         x, y = pos
 
         if self.global_map.min_x <= x <= self.global_map.max_x:
             if self.global_map.min_y <= y <= self.global_map.max_y:
-                return self.view.get(pos, self.global_map[x, y])
+                block = self._writes.get(pos)
+                if block is not None:
+                    return block
+                if self._base is not None:
+                    block = self._base.get(pos)
+                    if block is not None:
+                        return block
+                return self.global_map[x, y]
         raise IndexError
 
+    # returns the raw integer code of the visible block at x, y. use in hot
+    # loops instead of __getitem__ to avoid comparing BlockOverlay objects
+    def raw(self, x, y):
+        if self._writes or self._base is not None:
+            pos = (x, y)
+            block = self._writes.get(pos)
+            if block is None and self._base is not None:
+                block = self._base.get(pos)
+            if block is not None:
+                return block.raw()
+        return self.global_map.raw(x, y)
+
+    # returns the raw codes of the visible blocks between x1 and x2 (inclusive)
+    # in lane y
+    def raw_lane(self, y, x1, x2):
+        codes = self.global_map.raw_lane(y, x1, x2)
+        if self._view_touches(y, x1, x2):
+            for x in range(x1, x2 + 1):
+                codes[x - x1] = self.raw(x, y)
+        return codes
+
+    # checks if the view has any changes in lane y between x1 and x2
+    def _view_touches(self, y, x1, x2):
+        writes, layer = self._writes, self._base
+        while True:
+            for wx, wy in writes:
+                if wy == y and x1 <= wx <= x2:
+                    return True
+            if layer is None:
+                return False
+            writes, layer = layer.writes, layer.parent
+
+    # checks if blocks between x1 and x2 (inclusive) in lane y can be looked up
+    # in the global map's index, which they can if the global map has one and
+    # the view doesn't change anything in that range
+    def indexed(self, y, x1, x2):
+        return (self.global_map.index is not None and
+                not self._view_touches(y, x1, x2))
+
+    # returns the amount of blocks with the given raw codes between x1 and x2
+    # (inclusive) in lane y. code defaults to all the blocks that affect a
+    # player. uses the global map's index if the view doesn't change anything
+    # in that range
+    def count(self, y, x1, x2, codes=(BlockIndex.ACTIVE,)):
+        if self.indexed(y, x1, x2):
+            index = self.global_map.index
+            return sum(index.count(y, x1, x2, code) for code in codes)
+
+        return sum(1 for x in range(x1, x2 + 1) if
+                   self._matches(self.raw(x, y), codes))
+
+    # returns the x of the first block with the given raw code between x1 and
+    # x2 (inclusive) in lane y, or None if there isn't one
+    def first(self, y, x1, x2, code=BlockIndex.ACTIVE):
+        if self.indexed(y, x1, x2):
+            return self.global_map.index.first(y, x1, code, end=x2)
+
+        for x in range(x1, x2 + 1):
+            if self._matches(self.raw(x, y), (code,)):
+                return x
+        return None
+
+    @staticmethod
+    def _matches(raw, codes):
+        if BlockIndex.ACTIVE in codes and raw not in BlockIndex.INERT:
+            return True
+        return raw in codes
+
+    # places the player's cybertruck on top of the block at pos in the view.
+    # players only have one cybertruck on the map, so the one they placed
+    # before is removed if it is still there
+    def place_cybertruck(self, player_id, pos):
+        # copied so that the global map's block isn't changed
+        block = BlockOverlay(self[pos])
+
+        old = self.cybertrucks.get(player_id)
+        if old is not None and self.raw(*old) == RawBlock.CYBERTRUCK:
+            self[old] = self[old].get_underlay()
+
+        block.set_cybertruck()
+        self[pos] = block
+
+        cybertrucks = dict(self.cybertrucks)
+        cybertrucks[player_id] = pos
+        self.cybertrucks = cybertrucks
+
     # only makes changes to the mutable view, not the global map. use
     # update_global_map to propogate changes.
     def __setitem__(self, pos, block):
@@ -133,25 +634,49 @@ class Map:
 
         if self.global_map.min_x <= x <= self.global_map.max_x:
             if self.global_map.min_y <= y <= self.global_map.max_y:
-                self.view[pos] = BlockOverlay(block)
+                block = BlockOverlay(block)
+
+                # xor out the old view entry (if any) and xor in the new one
+                old = self._writes.get(pos)
+                if old is None and self._base is not None:
+                    old = self._base.get(pos)
+                if old is not None:
+                    self._hash ^= zobrist.key(x, y, old.get_block().value)
+                self._hash ^= zobrist.key(x, y, block.get_block().value)
+
+                self._writes[pos] = block
+                self.version = next_version()
                 return
         raise IndexError
 
+    # O(1) copy that keeps a reference to the global map. this map's pending
+    # writes are frozen into a layer that is shared with the copy, after which
+    # both only record their own writes
+    def copy(self):
+        if self._writes:
+            self._base = ViewLayer(self._writes, self._base)
+            self._writes = {}
+
+        cm = Map.__new__(Map)
+        cm.__dict__.update(self.__dict__)
+        cm._writes = {}
+        return cm
+
+    def __copy__(self):
+        return self.copy()
+
     # prevents deep-copying the global map
     def __deepcopy__(self, memo):
-        # copies all members (but shallow copies view + global map)
-        cm = copy.copy(self)
-        # make view a deep copy (but keep the global map shallow)
-        cm.view = copy.deepcopy(self.view)
-
-        return cm
+        return self.copy()
 
     def __hash__(self):
-        return hash(tuple([(*pos, self.view[pos]) for pos in
-                           sorted(self.view)]))
+        return self._hash
 
     def __eq__(self, other):
-        return self.view == other.view
+        if self._hash != other._hash:
+            return False
+        return (self._flat_view() == other._flat_view() and
+                self.cybertrucks == other.cybertrucks)
 
     def __repr__(self):
         return str(self)
@@ -163,11 +688,12 @@ class Map:
 def clean_map(state, from_x, to_x):
     for y in range(state.map.min_y, state.map.max_y + 1):
         for x in range(from_x, to_x + 1):
-            block = state.map.global_map[x, y]
+            block = state.map.global_map.raw(x, y)
 
             # remove any blocks that wasn't here when to opponent was here
-            if block == Block.OIL_SPILL:
+            if block == RawBlock.OIL_SPILL:
                 # just a guess, we can't do any better
                 state.map[x, y] = Block.EMPTY
-            elif block == Block.CYBERTRUCK:
-                state.map[x, y] = block.get_underlay()
+            elif block == RawBlock.CYBERTRUCK:
+                underlay = state.map.global_map[x, y].get_underlay()
+                state.map[x, y] = underlay
@@ -1,7 +1,9 @@
-from collections import deque
+import time
+from collections import deque, Counter
 
 from sloth.enums import Cmd
 from sloth.state import valid_actions, next_state
+from sloth.maps import BAD_BLOCKS
 
 class Weights:
     def __init__(self, raw_weights={}):
@@ -53,6 +55,46 @@ class Weights:
             self.player_score * (to.score - prev.score),
             ])
 
+    # pairs each weight with the player attribute that score weighs with it
+    def fields(self):
+        return [
+            (self.pos, 'x'),
+            (self.speed, 'speed'),
+
+            (self.boosts, 'boosts'),
+            (self.oils, 'oils'),
+            (self.lizards, 'lizards'),
+            (self.tweets, 'tweets'),
+            (self.emps, 'emps'),
+
+            (self.damage, 'damage'),
+            (self.player_score, 'score'),
+        ]
+
+    # checks if to_state a dominates to_state b, i.e. if a scores at least as
+    # well as b for every weight, judging by the weight's sign, and better for
+    # at least one. attributes with a zero weight and those that score ignores
+    # must match since they can still matter in later rounds
+    def dominates(self, a, b):
+        if a.opponent != b.opponent or a.map != b.map:
+            return False
+
+        a, b = a.player, b.player
+        if (a.id, a.y, a.boosting, a.boost_counter) != (b.id, b.y, b.boosting,
+                                                        b.boost_counter):
+            return False
+
+        better = False
+        for weight, name in self.fields():
+            diff = getattr(a, name) - getattr(b, name)
+            if diff == 0:
+                continue
+            if diff * weight <= 0:
+                return False
+            better = True
+
+        return better
+
     # returns the amount of weights
     @staticmethod
     def len():
@@ -78,6 +120,9 @@ class Weights:
     def __repr__(self):
         return str(vars(self))
 
+# amount of options kept at every depth by beam_search
+DEFAULT_BEAM_WIDTH = 16
+
 # does a bfs search from the current state up to the first move that is outside
 # the map's view or if the search depth reaches max_search_depth
 # returns a list of tuples of the form (actions, final state) where actions are
@@ -119,16 +164,201 @@ def search(state, opp_pred, max_search_depth):
 
     return options
 
-# does a movement search from the opponent's point of view.
-def opp_search(state, max_search_depth=2):
+# keeps the width best options under key, in order of rank. if per_lane is set
+# the best option in each lane is kept as well, even if it didn't make the cut
+def select_beam(options, key, width, per_lane=False):
+    ranked = sorted(options, key=key, reverse=True)
+    beam = ranked[:width]
+
+    if per_lane:
+        lanes = {o[1].player.y for o in beam}
+        for option in ranked[width:]:
+            if option[1].player.y not in lanes:
+                lanes.add(option[1].player.y)
+                beam.append(option)
+
+    return beam
+
+# beam search version of search which only expands the width best options at
+# every depth, as ranked by score with the given weights, which makes deeper
+# searches affordable. gives options of the same form as search, so its results
+# can be passed to score. like search it stops at the depth at which one of the
+# options leaves the map's view. if per_lane is set the beam keeps at least one
+# option per lane (see select_beam)
+def beam_search(state, opp_pred, max_search_depth, weights,
+                width=DEFAULT_BEAM_WIDTH, per_lane=False):
+    beam = [([], state)]
+    if state.player.x >= state.map.max_x:
+        return beam
+
+    for _ in range(max_search_depth):
+        options = []
+        for actions, cur_state in beam:
+            opp_cmd = opp_pred(cur_state)
+            for cmd in valid_actions(cur_state):
+                nstate = next_state(cur_state, cmd, opp_cmd)
+                options.append((actions + [cmd], nstate))
+
+        key = score_key(options, state, weights, opp_pred)
+        beam = select_beam(options, key, width, per_lane)
+
+        # checks all the options and not just the beam, like search does
+        if any(s.player.x >= s.map.max_x for _, s in options):
+            break
+
+    return beam
+
+# raised by dfs_search when its deadline passes
+class SearchTimeout(Exception):
+    pass
+
+# counts the nodes merged by the transposition table in dfs_search, the
+# next_state cache misses that merging them avoided and the nodes that were
+# pruned for being dominated
+search_stats = Counter()
+
+# filters out the (cmd, state) pairs with a state that's dominated by another
+# pair's state under the weights (see Weights.dominates)
+def undominated(weights, options):
+    kept = [o for o in options
+            if not any(weights.dominates(p[1], o[1]) for p in options)]
+    search_stats['dominated'] += len(options) - len(kept)
+    return kept
+
+# walks the search tree depth-first, yielding every node's state in preorder.
+# path holds the actions that lead to the yielded state and is updated in place
+# so it has to be copied if it should be kept. bound is a single element list
+# holding the maximum depth, which the caller can lower while walking.
+# if seen is a dict it is used as a transposition table: a node with the same
+# state at the same depth as an earlier node (and the same first action if
+# split_first is set) has the same subtree, so it is skipped along with its
+# subtree. seen maps each node to the range of transitions (in the order they
+# were made) in its subtree. if prune is set to
+# a Weights object, children that are dominated by a sibling are skipped. if a
+# deadline (in time.monotonic seconds) is given, SearchTimeout is raised once
+# it passes
+def walk_tree(state, opp_pred, path, bound, seen=None, split_first=False,
+              prune=None, deadline=None):
+    yield state
+    if bound[0] <= 0:
+        return
+
+    # the transitions made so far when merging, which tells how many of a
+    # merged subtree's transitions would have missed the next_state cache
+    calls = []
+
+    # yields the cmds and resulting states of the node's children
+    def children(node):
+        opp_cmd = opp_pred(node)
+        for cmd in valid_actions(node):
+            if seen is not None:
+                calls.append((node, cmd, opp_cmd))
+            yield cmd, next_state(node, cmd, opp_cmd)
+
+    def expand(node):
+        if deadline is not None and time.monotonic() > deadline:
+            raise SearchTimeout()
+        if prune is None:
+            return children(node)
+        return iter(undominated(prune, list(children(node))))
+
+    # each entry holds the untried children of a node on the current path, its
+    # key in seen and the amount of transitions made before it was expanded
+    stack = [(expand(state), None, 0)]
+
+    while stack:
+        pairs, key, start = stack[-1]
+        child = next(pairs, None) if len(path) < bound[0] else None
+
+        if child is None:
+            stack.pop()
+            if key is not None:
+                seen[key] = (start, len(calls))
+            if path:
+                path.pop()
+            continue
+
+        cmd, nstate = child
+        path.append(cmd)
+
+        child_key = None
+        if seen is not None:
+            child_key = (nstate, len(path), path[0] if split_first else None)
+            if child_key in seen:
+                start, end = seen[child_key]
+                search_stats['merged'] += 1
+                search_stats['saved'] += sum(
+                    1 for call in calls[start:end]
+                    if call not in next_state.cache)
+                path.pop()
+                continue
+
+        yield nstate
+
+        if len(path) < bound[0]:
+            start = len(calls)
+            stack.append((expand(nstate), child_key, start))
+        else:
+            if child_key is not None:
+                seen[child_key] = (len(calls), len(calls))
+            path.pop()
+
+# walks the tree once, keeping the options found at each depth in preorder.
+# as soon as an option leaves the map's view the deeper depths are ruled out,
+# so their options are dropped and the walk no longer goes past that depth.
+# returns the depth at which search stops and the options at that depth
+def _dfs_options(state, opp_pred, max_search_depth, transpositions=False,
+                 split_first=False, prune=None, deadline=None):
+    path = []
+    bound = [max_search_depth]
+    seen = {} if transpositions else None
+    found = [[] for _ in range(max_search_depth + 1)]
+
+    for cur_state in walk_tree(state, opp_pred, path, bound, seen,
+                               split_first, prune, deadline):
+        depth = len(path)
+        found[depth].append((list(path), cur_state))
+
+        if cur_state.player.x >= cur_state.map.max_x and depth < bound[0]:
+            bound[0] = depth
+            del found[depth + 1:]
+
+    return bound[0], found[bound[0]]
+
+# returns the depth at which search stops, which is the shallowest depth at
+# which an action sequence takes us outside of the map's view
+def search_depth(state, opp_pred, max_search_depth, transpositions=False,
+                 prune=None, deadline=None):
+    return _dfs_options(state, opp_pred, max_search_depth, transpositions,
+                        prune=prune, deadline=deadline)[0]
+
+# depth-first version of search that gives the same options in the same order.
+# the tree is walked once, so each node costs one transition and one opponent
+# prediction, and options deeper than where the search stops aren't kept. if transpositions is set, action sequences that lead to a state that was
+# already reached at the same depth are merged with the first one found, so
+# only one option is given per final state. if split_first is set, sequences
+# are only merged if their first actions match as well, which keeps the
+# options that score uses when weighing the next state. if prune is set to
+# the Weights used for scoring, sequences that reach a state that's dominated
+# by a sibling's state are dropped at every depth. if a deadline is given,
+# SearchTimeout is raised once it passes
+def dfs_search(state, opp_pred, max_search_depth, transpositions=False,
+               split_first=False, prune=None, deadline=None):
+    return _dfs_options(state, opp_pred, max_search_depth, transpositions,
+                        split_first, prune, deadline)[1]
+
+# does a movement search from the opponent's point of view. raises
+# SearchTimeout if the deadline passes
+def opp_search(state, max_search_depth=2, deadline=None):
     state = state.switch()
-    return search(state, lambda _: Cmd.ACCEL, max_search_depth=max_search_depth)
-
-# scores, ranks and returns the best scoring option. scores are calculated
-# using the weights dict. state is the current state from which to score. if
-# any of the actions results in the game being finished only the speeds are
-# taken into account
-def score(options, cur_state, weights, pred_opp=lambda s: Cmd.ACCEL):
+    return dfs_search(state, lambda _: Cmd.ACCEL,
+                      max_search_depth=max_search_depth, deadline=deadline)
+
+# returns the key function that score uses to rank the options. scores are
+# calculated using the weights dict. state is the current state from which to
+# score. if any of the actions results in the game being finished only the
+# speeds are taken into account
+def score_key(options, cur_state, weights, pred_opp=lambda s: Cmd.ACCEL):
     max_x = cur_state.map.global_map.max_x
 
     # check if any of actions result in a finish - we're in the endgame now
@@ -148,6 +378,11 @@ def score(options, cur_state, weights, pred_opp=lambda s: Cmd.ACCEL):
                 s += weights.next_state * weights.score(cur_state, nstate)
             return s
 
+    return key
+
+# scores, ranks and returns the best scoring option, see score_key
+def score(options, cur_state, weights, pred_opp=lambda s: Cmd.ACCEL):
+    key = score_key(options, cur_state, weights, pred_opp)
     actions, _ = max(options, key=key)
     return actions
 
@@ -177,19 +412,19 @@ def offensive_search(state, cmds=([Cmd.NOP]*2), pred_opp=lambda s: Cmd.ACCEL):
             max_x = state.map.global_map.max_x
             off = 10
 
+            # range of blocks to check (inclusive)
+            start = max(min_x, state.player.x - off)
+            end = min(state.player.x + off, max_x) - 1
+
             blocked_left = state.player.y == state.map.min_y
             if not blocked_left:
-                blocks = (state.map[x, state.player.y - 1].bad_block()
-                          for x in range(max(min_x, state.player.x - off),
-                                         min(state.player.x + off, max_x)))
-                blocked_left = any(blocks)
+                blocked_left = state.map.count(state.player.y - 1, start, end,
+                                               BAD_BLOCKS) > 0
 
             blocked_right = state.player.y == state.map.max_y
             if not blocked_right:
-                blocks = (state.map[x, state.player.y + 1].bad_block()
-                          for x in range(max(min_x, state.player.x - off),
-                                         min(state.player.x + off, max_x)))
-                blocked_right = any(blocks)
+                blocked_right = state.map.count(state.player.y + 1, start, end,
+                                                BAD_BLOCKS) > 0
 
             if blocked_left and blocked_right:
                 actions.append((6, Cmd.OIL))
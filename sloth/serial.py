@@ -0,0 +1,74 @@
+import struct
+
+from sloth.enums import Block
+from sloth.maps import Map, BlockOverlay
+from sloth.state import Player, State
+
+# compact binary encoding of states. the global map isn't part of the encoding,
+# only its version, which is checked when decoding since the state's view is
+# relative to the global map's contents. layout (little-endian):
+#   header: format version, global map version, map window, number of view
+#           entries
+#   player and opponent: the attributes in Player._key() order
+#   view entries: x, y, block and overlay codes of each changed block
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<BQhhbbH')
+PLAYER = struct.Struct('<Bhbbbbbbb?bbi')
+ENTRY = struct.Struct('<hbBB')
+
+# overlay code of blocks without an overlay
+NO_OVERLAY = 0xff
+
+def encode_player(player):
+    return PLAYER.pack(*player._key())
+
+def decode_player(data, offset=0):
+    return Player.from_key(PLAYER.unpack_from(data, offset))
+
+def encode_state(state):
+    m = state.map
+    view = m._flat_view()
+
+    parts = [
+        HEADER.pack(FORMAT_VERSION, m.global_map.version, m.min_x, m.max_x,
+                    m.min_y, m.max_y, len(view)),
+        encode_player(state.player),
+        encode_player(state.opponent),
+    ]
+
+    for (x, y), block in view.items():
+        overlay = block.overlay
+        parts.append(ENTRY.pack(x, y, block.block.value, NO_OVERLAY if
+                                overlay is None else overlay.value))
+
+    return b''.join(parts)
+
+# decodes a state encoded by encode_state. global_map must be the global map
+# the state was encoded with, in the same version
+def decode_state(data, global_map):
+    (version, map_version, min_x, max_x, min_y, max_y,
+     entries) = HEADER.unpack_from(data)
+
+    if version != FORMAT_VERSION:
+        raise ValueError(f'unsupported state format version {version}')
+    if map_version != global_map.version:
+        raise ValueError(f'state was encoded with global map version '
+                         f'{map_version}, got {global_map.version}')
+
+    offset = HEADER.size
+    state = State()
+    state.player = decode_player(data, offset)
+    offset += PLAYER.size
+    state.opponent = decode_player(data, offset)
+    offset += PLAYER.size
+
+    view = {}
+    for x, y, block, overlay in ENTRY.iter_unpack(
+            data[offset:offset + entries * ENTRY.size]):
+        view[x, y] = BlockOverlay(block)
+        if overlay != NO_OVERLAY:
+            view[x, y].overlay = Block(overlay)
+
+    state.map = Map.from_view(global_map, min_x, max_x, min_y, max_y, view)
+    return state
@@ -1,11 +1,57 @@
 import copy
-from functools import lru_cache
+import itertools
+from collections import Counter
 
-from sloth.enums import (Speed, next_speed, prev_speed, Cmd, Block,
-                         boost_speed, max_speed)
+from sloth import zobrist
+from sloth.cache import bounded_cache
+from sloth.maps import BlockIndex
+from sloth.enums import (Speed, Cmd, Block, RawBlock, NEXT_SPEED, PREV_SPEED,
+                         MAX_SPEED, BOOST_SPEED, TABLE_SPEEDS, TABLE_DAMAGES)
+
+_set = object.__setattr__
+
+# cmds that use a powerup against the other player instead of moving
+OFFENSIVE_CMDS = (Cmd.OIL, Cmd.TWEET, Cmd.EMP)
+
+ENGINES = ('python', 'numba')
+
+# the kernels module if the numba engine is in use, see set_engine
+_kernels = None
+
+# selects the engine used to walk paths and resolve collisions. the numba engine
+# runs the flat-array kernels in sloth.kernels and gives the same results as
+# the python engine. if numba isn't installed the python engine is used
+# instead, unless forced, in which case the kernels run uncompiled. returns the
+# engine in use
+def set_engine(name, force=False):
+    global _kernels
+
+    if name not in ENGINES:
+        raise ValueError(f'unknown engine {name}')
+
+    _kernels = None
+    if name == 'numba':
+        # imported here so that only the numba engine needs numpy
+        from sloth import kernels
+        if not (kernels.JIT or force):
+            return 'python'
+        _kernels = kernels
+
+    return name
+
+# how often player collisions were actually evaluated (checked), ruled out by
+# the trajectories (skipped) or ruled out before the trajectories were
+# calculated (decoupled)
+collision_stats = Counter()
 
 class Player:
+    __slots__ = ('id', 'x', 'y', 'speed', 'boosts', 'oils', 'lizards', 'tweets',
+                 'emps', 'boosting', 'boost_counter', 'damage', 'score', '_hash')
+
     def __init__(self, raw_player):
+        # zobrist hash of all the attributes, kept up to date by __setattr__
+        _set(self, '_hash', 0)
+
         # id
         self.id = raw_player['id']
 
@@ -55,42 +101,147 @@ class Player:
         other.score = self.score
         other.damage = self.damage
 
+    # creates a player from an attribute tuple as returned by _key(). sets the
+    # attributes directly and calculates the hash in one go instead of going
+    # through __setattr__ for every attribute
+    @staticmethod
+    def from_key(key):
+        player = Player.__new__(Player)
+        h = 0
+        for name, value in zip(Player.__slots__, key):
+            _set(player, name, value)
+            h ^= zobrist.key(name, value)
+        _set(player, '_hash', h)
+        return player
+
+    # all the attributes are immutable values so a shallow copy is enough
+    def copy(self):
+        # bypasses __setattr__ since the hash is copied as well
+        cp = Player.__new__(Player)
+        _set(cp, 'id', self.id)
+        _set(cp, 'x', self.x)
+        _set(cp, 'y', self.y)
+        _set(cp, 'speed', self.speed)
+        _set(cp, 'boosts', self.boosts)
+        _set(cp, 'oils', self.oils)
+        _set(cp, 'lizards', self.lizards)
+        _set(cp, 'tweets', self.tweets)
+        _set(cp, 'emps', self.emps)
+        _set(cp, 'boosting', self.boosting)
+        _set(cp, 'boost_counter', self.boost_counter)
+        _set(cp, 'damage', self.damage)
+        _set(cp, 'score', self.score)
+        _set(cp, '_hash', self._hash)
+        return cp
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
+
+    def _key(self):
+        return (self.id, self.x, self.y, self.speed, self.boosts, self.oils,
+                self.lizards, self.tweets, self.emps, self.boosting,
+                self.boost_counter, self.damage, self.score)
+
+    # incrementally updates the zobrist hash by xor-ing out the attribute's
+    # old value and xor-ing in the new one
+    def __setattr__(self, name, value):
+        try:
+            old = getattr(self, name)
+        except AttributeError:
+            h = self._hash
+        else:
+            if old == value:
+                return
+            h = self._hash ^ zobrist.key(name, old)
+        _set(self, '_hash', h ^ zobrist.key(name, value))
+        _set(self, name, value)
+
     def __hash__(self):
-        return hash(tuple(vars(self).values()))
+        return self._hash
 
     def __eq__(self, other):
-        return tuple(vars(self).values()) == tuple(vars(other).values())
+        if self is other:
+            return True
+        if self._hash != other._hash:
+            return False
+        return self._key() == other._key()
 
     def __repr__(self):
-        return str(vars(self))
+        return str({attr: getattr(self, attr) for attr in Player.__slots__
+                    if attr != '_hash'})
 
 class State:
+    __slots__ = ('map', 'player', 'opponent')
+
     def __init__(self):
         self.map = None
         self.player = None
         self.opponent = None
 
-    # returns a copy of the state with the player and opponent switched
+    # returns the state from the opponent's point of view. nothing is copied:
+    # the players are shared with this state and the map is an O(1) copy with
+    # its window moved, so the result must not be modified (use copy() first)
     def switch(self):
-        cp = self.copy()
-        cp.map.move_window(cp.player.x, cp.opponent.x)
-        cp.player, cp.opponent = cp.opponent, cp.player
+        cp = State()
+        cp.map = self.map.window(self.player.x, self.opponent.x)
+        cp.player = self.opponent
+        cp.opponent = self.player
         return cp
 
+    # copies the players and the map, but not the global map (see
+    # Map.__copy__). avoids going through copy.deepcopy's memo machinery
     def copy(self):
-        return copy.deepcopy(self)
+        cp = State()
+        cp.map = copy.copy(self.map)
+        cp.player = self.player.copy()
+        cp.opponent = self.opponent.copy()
+        return cp
+
+    def __copy__(self):
+        return self.copy()
+
+    def __deepcopy__(self, memo):
+        return self.copy()
 
     def __repr__(self):
-        return str(vars(self))
+        return str({attr: getattr(self, attr) for attr in State.__slots__})
 
+    # combines the players' and map's zobrist hashes, which are all kept up to
+    # date incrementally
     def __hash__(self):
-        return hash((self.player, self.opponent, self.map))
+        return (zobrist.rotl(self.player._hash) ^ self.opponent._hash ^
+                hash(self.map))
 
+    # each of the members short-circuits on its hash before comparing fully.
+    # interned states (see intern_state) are compared by identity
     def __eq__(self, other):
-        return ((self.player, self.opponent, self.map) ==
-                (other.player, other.opponent, other.map))
+        if self is other:
+            return True
+        return (self.player == other.player and
+                self.opponent == other.opponent and
+                self.map == other.map)
+
+# interning tables for players and states. structurally equal players and
+# states are mapped to the same object so that comparing them, e.g. when looking
+# them up in the simulation caches, short-circuits on identity. interned objects
+# are shared and must not be modified
+@bounded_cache()
+def intern_player(player):
+    return player
+
+# maps only compare their views, so the global map is part of the key as well
+@bounded_cache(key=lambda state: (state, state.map.global_map))
+def intern_state(state):
+    state.player = intern_player(state.player)
+    state.opponent = intern_player(state.opponent)
+    return state
 
 class Trajectory:
+    __slots__ = ('x_off', 'y_off', 'speed', 'damage', 'collided')
+
     def __init__(self, damage):
         self.x_off = 0
         self.y_off = 0
@@ -99,15 +250,15 @@ class Trajectory:
         self.collided = False
 
     def next_speed(self):
-        self.speed = next_speed(self.speed, self.damage)
+        self.speed = NEXT_SPEED[self.damage][self.speed]
 
     # if min_stop == True then the speed won't go below SPEED_1
     def prev_speed(self, min_stop=False):
         if min_stop:
             if self.speed > Speed.SPEED_1.value:
-                self.speed = prev_speed(self.speed, self.damage)
+                self.speed = PREV_SPEED[self.damage][self.speed]
         else:
-            self.speed = prev_speed(self.speed, self.damage)
+            self.speed = PREV_SPEED[self.damage][self.speed]
 
     def min_speed(self):
         self.speed = Speed.SPEED_1.value
@@ -133,8 +284,14 @@ class Trajectory:
     def straight(self):
         self.x_off += self.speed
 
+    # returns the x-interval covered by the player this round. note that
+    # x_off can be negative after running into a cybertruck while turning
+    def x_span(self, player):
+        x = player.x + self.x_off
+        return min(player.x, x), max(player.x, x)
+
     def boost(self):
-        self.speed = boost_speed(self.damage)
+        self.speed = BOOST_SPEED[self.damage]
         self.straight()
 
     def still(self):
@@ -146,7 +303,7 @@ class Trajectory:
         player.speed = self.speed
 
     def __repr__(self):
-        return str(vars(self))
+        return str({attr: getattr(self, attr) for attr in Trajectory.__slots__})
 
 class PathMods:
     def __init__(self):
@@ -165,18 +322,19 @@ class PathMods:
             'cybertrucks': []
         }
 
+    # block is a raw block code
     def penalise(self, block):
         self.penalties += 1
-        if block == Block.MUD:
+        if block == RawBlock.MUD:
             self.score -= 3
             self.damage += 1
-        elif block == Block.OIL_SPILL:
+        elif block == RawBlock.OIL_SPILL:
             self.score -= 4
             self.damage += 1
-        elif block == Block.WALL:
+        elif block == RawBlock.WALL:
             self.score -= 5
             self.damage += 2
-        elif block == Block.CYBERTRUCK:
+        elif block == RawBlock.CYBERTRUCK:
             self.score -= 7
             self.damage += 2
 
@@ -227,33 +385,49 @@ class StateTransition:
         self.from_state = from_state
         self.to_state = to_state
 
-# returns a list of valid movement actions for a given state
+# returns the valid movement actions for a given state
 def valid_actions(state):
+    return valid_player_actions(state.player, state.map)
+
+# valid actions for the given player, which doesn't have to be the state's
+# player. this avoids having to switch the state to get the opponent's actions
+def valid_player_actions(player, state_map):
+    key = (player.speed, player.damage, player.lizards > 0, player.boosts > 0,
+           player.boost_counter == 1, player.y > state_map.min_y,
+           player.y < state_map.max_y)
+    cmds = MOVE_TEMPLATES.get(key)
+    if cmds is None:
+        return _valid_cmds(*key)
+    return cmds
+
+# the valid movement cmds given everything they depend on, see MOVE_TEMPLATES
+def _valid_cmds(speed, damage, has_lizards, has_boosts, boost_ending,
+                can_left, can_right):
     valid = []
 
-    if state.player.speed < max_speed(state.player.damage):
+    if speed < MAX_SPEED[damage]:
         valid.append(Cmd.ACCEL)
 
-    if state.player.speed > 0:
+    if speed > 0:
         valid.append(Cmd.NOP)
         valid.append(Cmd.DECEL)
 
-        if state.player.y > state.map.min_y:
+        if can_left:
             valid.append(Cmd.LEFT)
-        if state.player.y < state.map.max_y:
+        if can_right:
             valid.append(Cmd.RIGHT)
-        if state.player.lizards > 0:
+        if has_lizards:
             valid.append(Cmd.LIZARD)
 
-    if state.player.damage > 0:
+    if damage > 0:
         valid.append(Cmd.FIX)
-    if state.player.boosts > 0:
-        if state.player.speed < boost_speed(state.player.damage):
+    if has_boosts:
+        if speed < BOOST_SPEED[damage]:
             valid.append(Cmd.BOOST)
-        if state.player.boost_counter == 1:
+        if boost_ending:
             valid.append(Cmd.BOOST)
 
-    return valid
+    return tuple(valid)
 
 def count_boosting(player):
     if player.boosting:
@@ -261,11 +435,25 @@ def count_boosting(player):
         # boost ran out
         if player.boost_counter == 0:
             player.boosting = False
-            player.speed = max_speed(player.damage)
+            player.speed = MAX_SPEED[player.damage]
 
+# looks up the trajectory the cmd results in before any hazards
 def calc_trajectory(player, cmd):
     traj = Trajectory(player.damage)
-    traj.speed = player.speed
+    try:
+        traj.x_off, traj.y_off, traj.speed = \
+            TRAJECTORIES[player.damage][player.speed][cmd]
+    except IndexError:
+        traj.x_off, traj.y_off, traj.speed = _calc_trajectory(player.speed,
+                                                              player.damage,
+                                                              cmd)
+    return traj
+
+# reference implementation of calc_trajectory's lookup, returns (x_off, y_off,
+# speed)
+def _calc_trajectory(speed, damage, cmd):
+    traj = Trajectory(damage)
+    traj.speed = speed
 
     if cmd == Cmd.NOP:
         traj.straight()
@@ -283,8 +471,25 @@ def calc_trajectory(player, cmd):
         traj.straight()
     elif cmd == Cmd.FIX:
         traj.still()
+    elif cmd in OFFENSIVE_CMDS:
+        # the player keeps driving at their current speed
+        traj.straight()
 
-    return traj
+    return traj.x_off, traj.y_off, traj.speed
+
+# trajectory of each cmd before hazards, indexed by [damage][speed][cmd]
+TRAJECTORIES = [[[_calc_trajectory(s, d, cmd) for cmd in Cmd.CmdEnum]
+                 for s in TABLE_SPEEDS] for d in TABLE_DAMAGES]
+
+# the valid cmds keyed by everything they depend on: (speed, damage, has
+# lizards, has boosts, boost_counter == 1, can turn left, can turn right). the
+# trajectory of each cmd is looked up in TRAJECTORIES
+def _move_templates():
+    flags = [(False, True)] * 5
+    return {key: _valid_cmds(*key) for key in
+            itertools.product(TABLE_SPEEDS, TABLE_DAMAGES, *flags)}
+
+MOVE_TEMPLATES = _move_templates()
 
 def check_fix(player, cmd):
     if cmd != Cmd.FIX:
@@ -300,9 +505,67 @@ def track_powerups(player, cmd):
     elif cmd == Cmd.LIZARD:
         player.lizards -= 1
         player.score += 4
+    elif cmd == Cmd.OIL:
+        player.oils -= 1
+        player.score += 4
+    elif cmd == Cmd.TWEET:
+        player.tweets -= 1
+        player.score += 4
+    elif cmd == Cmd.EMP:
+        player.emps -= 1
+        player.score += 4
+
+# checks if the player's emp hits the target, which happens if the target is
+# ahead of them and at most one lane away
+def emp_hits(player, target, cmd):
+    return (cmd == Cmd.EMP and target.x > player.x and
+            abs(target.y - player.y) <= 1)
+
+# a player that got hit by an emp doesn't move this round, slows down to
+# SPEED_1 and loses their boost
+def apply_emp(player, traj):
+    traj.x_off = 0
+    traj.y_off = 0
+    traj.speed = min(traj.speed, Speed.SPEED_1.value)
+    player.boosting = False
+    player.boost_counter = 0
+
+# places the oil spill or cybertruck dropped by the player onto the map. player
+# must be the player as they were at the start of the round since oil is
+# dropped where they started. drops are placed after everyone moved, so they
+# only affect the following rounds
+def drop_powerups(state_map, player, cmd):
+    if cmd == Cmd.OIL:
+        state_map[player.x, player.y] = Block.OIL_SPILL
+    elif cmd == Cmd.TWEET:
+        pos = getattr(cmd, 'pos', None)
+        if pos is not None:
+            # a cybertruck placed off the map (e.g. past the finish line) can't
+            # affect anyone
+            try:
+                state_map.place_cybertruck(player.id, pos)
+            except IndexError:
+                pass
+
+# players can only collide if their x-intervals overlap and they end the round
+# in the same lane
+def may_collide(player_a, player_b, traj_a, traj_b):
+    if player_a.y + traj_a.y_off != player_b.y + traj_b.y_off:
+        return False
+    a_x1, a_x2 = traj_a.x_span(player_a)
+    b_x1, b_x2 = traj_b.x_span(player_b)
+    return a_x1 <= b_x2 and b_x1 <= a_x2
 
 def check_collisions(player_a, player_b, traj_a, traj_b, a_lizarding,
                      b_lizarding):
+    if _kernels is not None:
+        (traj_a.x_off, traj_a.y_off, traj_a.collided, traj_b.x_off,
+         traj_b.y_off, traj_b.collided) = _kernels.collide(
+             player_a.x, player_a.y, traj_a.x_off, traj_a.y_off,
+             traj_a.collided, a_lizarding, player_b.x, player_b.y,
+             traj_b.x_off, traj_b.y_off, traj_b.collided, b_lizarding)
+        return
+
     # two types: fender-bender from behind or ending up on same block
 
     # run-in from behind - occurs when in the same lane and one bot tries
@@ -367,10 +630,12 @@ def check_collisions(player_a, player_b, traj_a, traj_b, a_lizarding,
                 traj_a.x_off = player_b.x + traj_b.x_off - 1 - player_a.x
                 traj_a.collided = True
 
-def gen_path(state_map, player, traj, lizarding):
+# returns the lane and the start and end x (inclusive) of the path a player
+# drives along given their trajectory, or None if they didn't move
+def path_bounds(state_map, player, traj, lizarding):
     # didn't move at all, so no path to generate
     if traj.x_off == traj.y_off == 0:
-        return
+        return None
 
     if not lizarding:
         # player collided edge case
@@ -382,53 +647,113 @@ def gen_path(state_map, player, traj, lizarding):
         start = player.x + traj.x_off
     end = player.x + traj.x_off
 
-    y = player.y + traj.y_off
-    for x in range(start, end + 1):
-        # went outside the map
-        if x >= state_map.global_map.max_x:
-            break
-        yield (x, y)
+    # stop before going outside the map
+    end = min(end, state_map.global_map.max_x - 1)
+
+    return player.y + traj.y_off, start, end
+
+# returns the x of the first block with the given raw code between start and
+# end (inclusive) in lane y of the map, or None if there isn't one. like
+# Map.first, but the numba engine scans the map's lanes with a kernel where the
+# global map's index can't be used
+def first_block(state_map, y, start, end, code=BlockIndex.ACTIVE):
+    if _kernels is None:
+        return state_map.first(y, start, end, code)
+    if state_map.indexed(y, start, end):
+        return state_map.global_map.index.first(y, start, code, end=end)
+
+    lanes = _kernels.map_lanes(state_map)
+    i = _kernels.first_block(lanes[y - 1], start - 1, end, code)
+    return None if i < 0 else i + 1
 
 def resolve_cybertruck_collisions(state_map, player, traj, lizarding):
     path_mods = PathMods()
 
-    for x, y in gen_path(state_map, player, traj, lizarding):
-        block = state_map[x, y]
+    bounds = path_bounds(state_map, player, traj, lizarding)
+    if bounds is None:
+        return path_mods
+
+    y, start, end = bounds
+    x = first_block(state_map, y, start, end, RawBlock.CYBERTRUCK)
 
-        if block == Block.CYBERTRUCK:
-            traj.min_speed()
-            # stop right before cybertruck
-            traj.x_off = x - player.x - 1
-            path_mods.penalise(block)
-            path_mods.hit_cybertruck((x, y))
-            break
+    if x is not None:
+        traj.min_speed()
+        # stop right before cybertruck
+        traj.x_off = x - player.x - 1
+        path_mods.penalise(RawBlock.CYBERTRUCK)
+        path_mods.hit_cybertruck((x, y))
 
     return path_mods
 
+# the outcome of driving along a segment of a lane: the final speed followed by
+# the oils, boosts, lizards, tweets and emps picked up and the penalties, damage
+# and score incurred. cached on the segment, entry speed, damage and the
+# versions of the global map and the map's view
+@bounded_cache(key=lambda state_map, y, start, end, speed, damage: (
+    y, start, end, speed, damage, state_map.global_map.version,
+    state_map.version))
+def walk_segment(state_map, y, start, end, speed, damage):
+    # the numba engine walks the whole segment, which is faster than asking the
+    # index if it has any blocks that affect the player
+    if _kernels is not None:
+        lanes = _kernels.map_lanes(state_map)
+        return _kernels.walk_blocks(lanes[y - 1], start - 1, end, speed,
+                                    damage)
+
+    oils = boosts = lizards = tweets = emps = 0
+    penalties = damage_taken = score = 0
+
+    # skip straight from one block that affects the player to the next, most
+    # segments don't have any
+    x = state_map.first(y, start, end)
+
+    while x is not None:
+        block = state_map.raw(x, y)
+
+        if block == RawBlock.MUD or block == RawBlock.OIL_SPILL:
+            if speed > Speed.SPEED_1.value:
+                speed = PREV_SPEED[damage][speed]
+            penalties += 1
+            damage_taken += 1
+            score -= 3 if block == RawBlock.MUD else 4
+        elif block == RawBlock.WALL:
+            speed = Speed.SPEED_1.value
+            penalties += 1
+            damage_taken += 2
+            score -= 5
+        elif block == RawBlock.OIL_ITEM:
+            oils += 1
+            score += 4
+        elif block == RawBlock.BOOST:
+            boosts += 1
+            score += 4
+        elif block == RawBlock.LIZARD:
+            lizards += 1
+            score += 4
+        elif block == RawBlock.TWEET:
+            tweets += 1
+            score += 4
+        elif block == RawBlock.EMP:
+            emps += 1
+            score += 4
+
+        x = state_map.first(y, x + 1, end)
+
+    return (speed, oils, boosts, lizards, tweets, emps, penalties,
+            damage_taken, score)
+
 def calc_path_mods(state_map, player, traj, lizarding):
     path_mods = PathMods()
 
-    for x, y in gen_path(state_map, player, traj, lizarding):
-        block = state_map[x, y]
-
-        if block == Block.EMPTY:
-            pass
-        elif block == Block.MUD or block == Block.OIL_SPILL:
-            traj.prev_speed(min_stop=True)
-            path_mods.penalise(block)
-        elif block == Block.WALL:
-            traj.min_speed()
-            path_mods.penalise(block)
-        elif block == Block.OIL_ITEM:
-            path_mods.oil_pickup()
-        elif block == Block.BOOST:
-            path_mods.boost_pickup()
-        elif block == Block.LIZARD:
-            path_mods.lizard_pickup()
-        elif block == Block.TWEET:
-            path_mods.tweet_pickup()
-        elif block == Block.EMP:
-            path_mods.emp_pickup()
+    bounds = path_bounds(state_map, player, traj, lizarding)
+    if bounds is None:
+        return path_mods
+
+    y, start, end = bounds
+    (traj.speed, path_mods.oils, path_mods.boosts, path_mods.lizards,
+     path_mods.tweets, path_mods.emps, path_mods.penalties, path_mods.damage,
+     path_mods.score) = walk_segment(state_map, y, start, end, traj.speed,
+                                     traj.damage)
 
     return path_mods
 
@@ -441,7 +766,7 @@ def check_cybertrucks(state, consumed):
 # caps the player's speed to its maximum allowable value given their damage
 def cap_speed(player):
     if not player.boosting:
-        player.speed = min(max_speed(player.damage), player.speed)
+        player.speed = min(MAX_SPEED[player.damage], player.speed)
 
 # checks that when a player decelerates their boosting is canceled
 def decel_boost_cancel(player, cmd):
@@ -449,17 +774,115 @@ def decel_boost_cancel(player, cmd):
         player.boosting = False
         player.boost_counter = 0
 
-# converts offensive actions to a NOP so that they can be passed to next_state
+# converts offensive actions to a NOP, for when only a cmd's movement matters
 def ns_filter(cmd):
-    if cmd in [Cmd.OIL, Cmd.TWEET, Cmd.EMP]:
+    if cmd in OFFENSIVE_CMDS:
         return Cmd.NOP
     return cmd
 
+# returns the furthest x offset a player can reach this round. hazards can only
+# shorten this
+def x_reach(player, cmd):
+    reach = player.speed
+    if cmd == Cmd.ACCEL:
+        reach = max(reach, NEXT_SPEED[player.damage][player.speed])
+    elif cmd == Cmd.BOOST:
+        reach = max(reach, BOOST_SPEED[player.damage])
+    return reach
+
+# returns the lanes a player can occupy this round
+def lane_reach(player, cmd):
+    if cmd == Cmd.LEFT:
+        return (player.y - 1, player.y)
+    if cmd == Cmd.RIGHT:
+        return (player.y, player.y + 1)
+    return (player.y, player.y)
+
+# checks if the players could possibly collide this round. if they can't, each
+# player's next state only depends on their own cmd and the map. a player can
+# end up one block behind where they started if they turn into a cybertruck
+def may_interact(player_a, player_b, cmd_a, cmd_b):
+    if player_a.x - 1 > player_b.x + x_reach(player_b, cmd_b):
+        return False
+    if player_b.x - 1 > player_a.x + x_reach(player_a, cmd_a):
+        return False
+
+    a_min_y, a_max_y = lane_reach(player_a, cmd_a)
+    b_min_y, b_max_y = lane_reach(player_b, cmd_b)
+    return a_min_y <= b_max_y and b_min_y <= a_max_y
+
+# calculates a single player's next state given that they can't interact with
+# the other player. returns the new player and the positions of the
+# cybertrucks they crashed into. the returned player is shared between cache
+# hits and must be copied before modifying it
+def next_player(player, cmd, state_map):
+    # the player's attribute tuple keeps the cache key immutable. maps only
+    # compare their views, so the global map is part of the key as well
+    return _next_player(player._key(), cmd, state_map, state_map.global_map)
+
+@bounded_cache()
+def _next_player(player_key, cmd, state_map, global_map):
+    player = Player.from_key(player_key)
+    lizarding = cmd == Cmd.LIZARD
+
+    count_boosting(player)
+    traj = calc_trajectory(player, cmd)
+    check_fix(player, cmd)
+    track_powerups(player, cmd)
+
+    cyber_mods = resolve_cybertruck_collisions(state_map, player, traj,
+                                               lizarding)
+    cyber_mods.apply(player)
+
+    mods = calc_path_mods(state_map, player, traj, lizarding)
+
+    traj.apply(player)
+    mods.apply(player)
+
+    decel_boost_cancel(player, cmd)
+    cap_speed(player)
+
+    consumed = (tuple(cyber_mods.consumed['cybertrucks']) +
+                tuple(mods.consumed['cybertrucks']))
+    return player, consumed
+
+# expose the cache's interface on the wrapper
+next_player.cache_clear = _next_player.cache_clear
+next_player.cache_info = _next_player.cache_info
+next_player.resize = _next_player.resize
+
 # calculates the next state given the player and opponent's cmd
-# NOTE it is assumed that both cmds are valid movement cmds
-# NOTE offensive cmds are not supported
-@lru_cache(maxsize=None)
+# NOTE it is assumed that both cmds are valid cmds
+@bounded_cache()
 def next_state(state, cmd, opp_cmd):
+    if (may_interact(state.player, state.opponent, cmd, opp_cmd) or
+            emp_hits(state.player, state.opponent, cmd) or
+            emp_hits(state.opponent, state.player, opp_cmd)):
+        return intern_state(next_state_joint(state, cmd, opp_cmd))
+
+    # the players can't collide, so calculate each one separately and assemble
+    # the results
+    collision_stats['decoupled'] += 1
+    player, player_consumed = next_player(state.player, cmd, state.map)
+    opp, opp_consumed = next_player(state.opponent, opp_cmd, state.map)
+
+    nstate = State()
+    nstate.map = state.map.copy()
+    nstate.player = player.copy()
+    nstate.opponent = opp.copy()
+
+    check_cybertrucks(nstate,
+                      {'cybertrucks': list(player_consumed + opp_consumed)})
+
+    drop_powerups(nstate.map, state.player, cmd)
+    drop_powerups(nstate.map, state.opponent, opp_cmd)
+
+    return intern_state(nstate)
+
+# calculates the next state for both players together, taking collisions
+# between them into account
+def next_state_joint(state, cmd, opp_cmd):
+    from_state = state
     state = state.copy()
 
     ## keep track of boosting counters
@@ -478,6 +901,12 @@ def next_state(state, cmd, opp_cmd):
     track_powerups(state.player, cmd)
     track_powerups(state.opponent, opp_cmd)
 
+    ## check for emps, the players' positions are still the same as from_state
+    if emp_hits(state.player, state.opponent, cmd):
+        apply_emp(state.opponent, opp_traj)
+    if emp_hits(state.opponent, state.player, opp_cmd):
+        apply_emp(state.player, player_traj)
+
     ## check for cybertruck collisions
     player_cyber_mods = resolve_cybertruck_collisions(state.map, state.player,
                                                       player_traj,
@@ -493,8 +922,12 @@ def next_state(state, cmd, opp_cmd):
     consumed = {k: consumed[k] + opp_cyber_mods.consumed[k] for k in consumed}
 
     ## check for collisions
-    check_collisions(state.player, state.opponent, player_traj, opp_traj,
-                     cmd == Cmd.LIZARD, opp_cmd == Cmd.LIZARD)
+    if may_collide(state.player, state.opponent, player_traj, opp_traj):
+        collision_stats['checked'] += 1
+        check_collisions(state.player, state.opponent, player_traj, opp_traj,
+                         cmd == Cmd.LIZARD, opp_cmd == Cmd.LIZARD)
+    else:
+        collision_stats['skipped'] += 1
 
     ## check players' path for penalties and powerups
     player_mods = calc_path_mods(state.map, state.player, player_traj,
@@ -523,8 +956,56 @@ def next_state(state, cmd, opp_cmd):
     cap_speed(state.player)
     cap_speed(state.opponent)
 
+    ## place dropped oil spills and cybertrucks
+    drop_powerups(state.map, from_state.player, cmd)
+    drop_powerups(state.map, from_state.opponent, opp_cmd)
+
     return state
 
+# movement cmds that calc_opp_cmd can recognise
+MOVE_CMDS = (Cmd.ACCEL, Cmd.NOP, Cmd.DECEL, Cmd.LEFT, Cmd.RIGHT, Cmd.LIZARD,
+             Cmd.FIX, Cmd.BOOST)
+
+# hazard-free outcome of each movement cmd, keyed by the player's speed, damage
+# and boosting state
+_move_baselines = {}
+
+# returns the (x_off, y_off, speed) each movement cmd results in when nothing
+# gets in the player's way
+def move_baselines(speed, damage, boosting, boost_counter):
+    key = (speed, damage, boosting, boost_counter)
+    try:
+        return _move_baselines[key]
+    except KeyError:
+        pass
+
+    baselines = {}
+    for cmd in MOVE_CMDS:
+        player = Player.from_key((0, 0, 0, speed, 1, 0, 1, 0, 0, boosting,
+                                  boost_counter, damage, 0))
+        count_boosting(player)
+        traj = calc_trajectory(player, cmd)
+        check_fix(player, cmd)
+        track_powerups(player, cmd)
+        traj.apply(player)
+        decel_boost_cancel(player, cmd)
+        cap_speed(player)
+        baselines[cmd] = (player.x, player.y, player.speed)
+
+    _move_baselines[key] = baselines
+    return baselines
+
+# returns the cmds that could have moved the player by x_off and y_off and left
+# them with the given speed. hazards and collisions can only shorten a move,
+# slow the player down or (when ending on the same block as the other player)
+# send them back to their lane, so a cmd is only a candidate if its hazard-free
+# outcome can be cut short to the actual one
+def opp_cmd_candidates(player, x_off, y_off, speed):
+    baselines = move_baselines(player.speed, player.damage, player.boosting,
+                               player.boost_counter)
+    return {cmd for cmd, (b_x_off, b_y_off, b_speed) in baselines.items()
+            if x_off <= b_x_off and y_off in (b_y_off, 0) and speed <= b_speed}
+
 # given the player's cmd, the initial state and the state thereafter this
 # calculates cmd the opponent took. returns None if unable to figure out.
 # note that this only attempts to calculate cmds that were movement cmds, so
@@ -540,7 +1021,7 @@ def calc_opp_cmd(cmd, from_state, to_state):
 
     # if their boost counter was one their effective speed was actually 9
     if from_state.opponent.boost_counter == 1:
-        from_state.opponent.speed = max_speed(from_state.opponent.damage)
+        from_state.opponent.speed = MAX_SPEED[from_state.opponent.damage]
     speed = from_state.opponent.speed
 
     fx, fy = to_state.opponent.x, to_state.opponent.y
@@ -549,9 +1030,13 @@ def calc_opp_cmd(cmd, from_state, to_state):
     x_off = fx - x
     y_off = fy - y
 
-    # go through all the valid actions that they could've taken and check if
-    # the next state matches their actual state
-    for opp_cmd in valid_actions(from_state.switch()):
+    # go through the actions that they could've taken and check if the next
+    # state matches their actual state. only actions whose hazard-free outcome
+    # could have been cut short to their actual state need to be simulated
+    candidates = opp_cmd_candidates(from_state.opponent, x_off, y_off, fspeed)
+    for opp_cmd in valid_player_actions(from_state.opponent, from_state.map):
+        if opp_cmd not in candidates:
+            continue
         nstate = next_state(from_state, cmd, opp_cmd)
         if ((nstate.opponent.x, nstate.opponent.y, nstate.opponent.speed) ==
                 (fx, fy, fspeed)):
@@ -567,12 +1052,12 @@ def calc_opp_cmd(cmd, from_state, to_state):
         return Cmd.FIX
 
     if x_off > speed:
-        if x_off <= next_speed(speed):
+        if x_off <= NEXT_SPEED[0][speed]:
             return Cmd.ACCEL
         else:
             return Cmd.BOOST
 
-    if x_off == prev_speed(speed):
+    if x_off == PREV_SPEED[0][speed]:
         return Cmd.DECEL
 
     if x_off == speed:
@@ -584,9 +1069,9 @@ def calc_opp_cmd(cmd, from_state, to_state):
             block = from_state.map[_x, _y]
 
             if block == Block.MUD:
-                _speed = prev_speed(_speed)
+                _speed = PREV_SPEED[0][_speed]
             elif block == Block.OIL_SPILL:
-                _speed = prev_speed(_speed)
+                _speed = PREV_SPEED[0][_speed]
             elif block == Block.WALL:
                 _speed = Speed.SPEED_1.value
 
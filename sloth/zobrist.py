@@ -0,0 +1,26 @@
+import random
+
+# each zobrist key is derived from a seed and its (field, value) combination
+# alone, so hashes stay the same between runs no matter in which order the keys
+# are first used. keys are cached once derived
+SEED = 0x5107
+_keys = {}
+
+MASK = (1 << 64) - 1
+
+# returns the random 64-bit key for the given (field, value) combination
+def key(*args):
+    try:
+        return _keys[args]
+    except KeyError:
+        # ints, bools and int enums with equal values are equal keys, so they
+        # have to be seeded the same
+        seed = repr((SEED,) + tuple(int(a) if isinstance(a, int) else a
+                                    for a in args))
+        k = _keys[args] = random.Random(seed).getrandbits(64)
+        return k
+
+# rotates a 64-bit hash left by one bit. used to combine hashes of objects that
+# can swap places (e.g. player and opponent) without the swap cancelling out
+def rotl(h):
+    return ((h << 1) | (h >> 63)) & MASK
@@ -0,0 +1,52 @@
+import random
+
+from sloth.state import Player, State
+from sloth.maps import GlobalMap, Map
+from sloth.enums import Block, Speed
+
+# random states on a shared map with mixed blocks and cybertrucks
+def setup_states(count, seed=0, map_type=GlobalMap):
+    rng = random.Random(seed)
+    blocks = [Block.EMPTY] * 8 + [Block.MUD, Block.OIL_SPILL, Block.WALL,
+                                  Block.OIL_ITEM, Block.BOOST, Block.LIZARD,
+                                  Block.TWEET, Block.EMP]
+
+    global_map = map_type(1500, 4)
+    raw_map = [[{
+        'position': {
+            'x': x,
+            'y': y,
+        },
+        'surfaceObject': rng.choice(blocks).value if x > 2 else 0,
+        'isOccupiedByCyberTruck': x > 2 and rng.random() < 0.05,
+    } for x in range(1, 40)] for y in range(1, 5)]
+    track_map = Map(raw_map, global_map)
+
+    def player(pid):
+        return Player({
+            'id': pid,
+            'position': {
+                'x': rng.randint(1, 8),
+                'y': rng.randint(1, 4),
+            },
+            'speed': rng.choice([0, 3, 5, 6, 8, 9, 15]),
+            'powerups': ['BOOST', 'LIZARD'] * rng.randint(0, 1),
+            'boosting': False,
+            'boostCounter': 0,
+            'damage': rng.randint(0, 5),
+        })
+
+    states = []
+    for _ in range(count):
+        state = State()
+        state.map = track_map
+        state.player = player(1)
+        state.opponent = player(2)
+
+        if state.player.speed == Speed.BOOST_SPEED.value:
+            state.player.boosting = True
+            state.player.boost_counter = rng.randint(1, 5)
+
+        states.append(state)
+
+    return states
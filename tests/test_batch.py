@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from sloth.batch import StateBatch, next_state_batch, encode_cmds, map_lanes
+from sloth.state import next_state, valid_actions
+from sloth.maps import GlobalMap, CompactGlobalMap
+from sloth.enums import Block
+
+from helpers import setup_states
+
+class TestStateBatch:
+    @pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+    def test_map_lanes(self, map_type):
+        state_map = setup_states(1, map_type=map_type)[0].map
+        state_map.global_map.set_cybertruck(20, 3)
+        state_map = state_map.copy()
+        state_map[5, 2] = Block.OIL_SPILL
+
+        gmap = state_map.global_map
+        expected = [[state_map.raw(x, y) for x in range(1, gmap.max_x + 1)]
+                    for y in range(1, gmap.max_y + 1)]
+        lanes = map_lanes(state_map)
+        assert lanes.tolist() == expected
+        assert lanes[2, 19] == Block.CYBERTRUCK.value
+        assert lanes[1, 4] == Block.OIL_SPILL.value
+
+        # changes to the global map aren't hidden by the cache
+        gmap[30, 1] = Block.WALL
+        assert map_lanes(state_map)[0, 29] == Block.WALL.value
+
+    def test_roundtrip(self):
+        states = setup_states(10)
+        assert StateBatch(states).to_states() == states
+
+    def test_same_map(self):
+        states = setup_states(2)
+        states[1].map = states[1].map.copy()
+        states[1].map[1, 1] = Block.MUD
+
+        with pytest.raises(ValueError):
+            StateBatch(states)
+
+    def test_matches_next_state(self):
+        states, cmds, opp_cmds = [], [], []
+        for state in setup_states(60):
+            for cmd, opp_cmd in itertools.product(valid_actions(state),
+                    valid_actions(state.switch())):
+                states.append(state)
+                cmds.append(cmd)
+                opp_cmds.append(opp_cmd)
+
+        batch = next_state_batch(StateBatch(states), encode_cmds(cmds),
+                                 encode_cmds(opp_cmds))
+
+        for state, cmd, opp_cmd, nstate in zip(states, cmds, opp_cmds,
+                                               batch.to_states()):
+            assert next_state(state, cmd, opp_cmd) == nstate
+
+    def test_multiple_steps(self):
+        states = setup_states(40, seed=1)
+        cmds = [valid_actions(s)[0] for s in states]
+
+        batch = StateBatch(states)
+        for _ in range(3):
+            batch = next_state_batch(batch, encode_cmds(cmds),
+                                     encode_cmds(cmds))
+            states = [next_state(s, cmd, cmd) for s, cmd in zip(states, cmds)]
+            assert batch.to_states() == states
@@ -0,0 +1,68 @@
+from sloth.cache import bounded_cache
+
+class TestBoundedCache:
+    def test_memoize(self):
+        calls = []
+
+        @bounded_cache(maxsize=10)
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        assert square(2) == 4
+        assert square(2) == 4
+        assert calls == [2]
+
+        info = square.cache_info()
+        assert info.hits == 1
+        assert info.misses == 1
+        assert info.currsize == 1
+
+        square.cache_clear()
+        assert square.cache_info().currsize == 0
+        assert square.cache_info().hits == 0
+        assert square(2) == 4
+        assert calls == [2, 2]
+
+    def test_lru_eviction(self):
+        calls = []
+
+        @bounded_cache(maxsize=2)
+        def ident(x):
+            calls.append(x)
+            return x
+
+        ident(1)
+        ident(2)
+        # makes 1 the most recently used
+        ident(1)
+        # evicts 2
+        ident(3)
+        assert ident.cache_info().evictions == 1
+        assert ident.cache_info().currsize == 2
+
+        ident(1)
+        assert calls == [1, 2, 3]
+        ident(2)
+        assert calls == [1, 2, 3, 2]
+
+        ident.resize(1)
+        assert ident.cache_info().currsize == 1
+        assert ident.cache_info().evictions == 3
+
+    def test_method(self):
+        class Obj:
+            def __init__(self, val):
+                self.val = val
+
+            @bounded_cache()
+            def add(self, x):
+                return self.val + x
+
+        a, b = Obj(1), Obj(2)
+        assert a.add(1) == 2
+        assert b.add(1) == 3
+        assert a.add(1) == 2
+        assert Obj.add.cache_info().hits == 1
+        a.add.cache_clear()
+        assert Obj.add.cache_info().currsize == 0
@@ -1,4 +1,6 @@
-from sloth.enums import max_speed, next_speed, prev_speed, Speed, boost_speed
+from sloth.enums import (max_speed, next_speed, prev_speed, Speed, boost_speed,
+                         SPEED_STEPS, TABLE_SPEEDS, TABLE_DAMAGES, MAX_SPEED,
+                         BOOST_SPEED, NEXT_SPEED, PREV_SPEED, Cmd)
 
 class TestEnumFuncs:
     def test_max_speed(self):
@@ -24,3 +26,49 @@ class TestEnumFuncs:
         assert boost_speed(0) == Speed.BOOST_SPEED.value
         for i in range(1, 7):
             assert boost_speed(i) == max_speed(i)
+
+    def test_prev_speed(self):
+        assert prev_speed(Speed.SPEED_2.value) == Speed.SPEED_1.value
+        assert prev_speed(Speed.MAX_SPEED.value) == Speed.SPEED_3.value
+        assert prev_speed(Speed.INIT_SPEED.value) == Speed.SPEED_1.value
+        assert prev_speed(Speed.SPEED_1.value) == Speed.MIN_SPEED.value
+        assert prev_speed(Speed.BOOST_SPEED.value, 3) == Speed.SPEED_2.value
+
+    def test_speed_tables(self):
+        for damage in TABLE_DAMAGES:
+            assert MAX_SPEED[damage] == max_speed(damage)
+            assert BOOST_SPEED[damage] == boost_speed(damage)
+
+            for speed in TABLE_SPEEDS:
+                nspeed = next((s for s in SPEED_STEPS if speed < s <=
+                               max_speed(damage)), max_speed(damage))
+                pspeed = next((s for s in SPEED_STEPS[::-1] if s < speed and
+                               s <= max_speed(damage)), SPEED_STEPS[0])
+
+                assert NEXT_SPEED[damage][speed] == nspeed
+                assert next_speed(speed, damage) == nspeed
+                assert PREV_SPEED[damage][speed] == pspeed
+                assert prev_speed(speed, damage) == pspeed
+
+class TestCmd:
+    def test_str(self):
+        assert str(Cmd(Cmd.NOP)) == 'NOTHING'
+        assert str(Cmd(Cmd.BOOST)) == 'USE_BOOST'
+        assert str(Cmd(Cmd.TWEET, pos=(10, 2))) == 'USE_TWEET 2 10'
+
+    def test_parse(self):
+        assert Cmd('ACCELERATE') == Cmd.ACCEL
+        assert Cmd('USE_LIZARD') is Cmd(Cmd.LIZARD)
+
+    def test_interned(self):
+        assert Cmd(Cmd.FIX) is Cmd(Cmd.FIX)
+        assert Cmd(Cmd.TWEET, pos=(3, 1)) is Cmd(Cmd.TWEET, pos=(3, 1))
+        assert Cmd(Cmd.TWEET, pos=(3, 1)) is not Cmd(Cmd.TWEET, pos=(3, 2))
+
+    def test_opcodes(self):
+        assert Cmd.NOP == 0
+        assert Cmd(Cmd.EMP) == Cmd.EMP
+        assert Cmd.EMP == Cmd(Cmd.EMP)
+        assert Cmd(Cmd.TWEET, pos=(3, 1)) == Cmd.TWEET
+        assert Cmd(Cmd.TWEET, pos=(3, 1)) != Cmd(Cmd.TWEET, pos=(3, 2))
+        assert len(set(Cmd.CmdEnum)) == len(Cmd.CmdEnum)
@@ -0,0 +1,122 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from sloth import kernels
+from sloth.state import next_state_joint, valid_actions, walk_segment
+from sloth.state import set_engine
+from sloth.maps import GlobalMap, CompactGlobalMap
+from sloth.enums import Block
+
+from helpers import setup_states
+
+# runs fn with the python engine and then with the (possibly uncompiled)
+# kernels, clearing the segment cache so that the results aren't shared
+def both_engines(fn):
+    results = []
+    for engine in ['python', 'numba']:
+        walk_segment.cache_clear()
+        set_engine(engine, force=True)
+        try:
+            results.append(fn())
+        finally:
+            set_engine('python')
+            walk_segment.cache_clear()
+    return results
+
+class TestKernels:
+    @pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+    def test_engines_match(self, map_type):
+        states = setup_states(30, map_type=map_type)
+        states[0].map[12, 2] = Block.WALL
+
+        def run():
+            return [next_state_joint(state, cmd, opp_cmd)
+                    for state in states
+                    for cmd in valid_actions(state)
+                    for opp_cmd in valid_actions(state.switch())]
+
+        python, jit = both_engines(run)
+        assert python == jit
+
+    def test_walk_segment(self):
+        state_map = setup_states(1)[0].map
+        state_map[12, 2] = Block.WALL
+
+        def run():
+            return [walk_segment(state_map, y, start, start + 15, speed, 1)
+                    for y in range(1, 5) for start in range(1, 20)
+                    for speed in [3, 9, 15]]
+
+        python, jit = both_engines(run)
+        assert python == jit
+        assert all(type(v) is int for result in jit for v in result)
+
+    def test_first_block(self):
+        lane = np.array([0, 4, 3, 100, 1, 3], dtype=np.int64)
+        assert kernels.first_block(lane, 0, 5, Block.CYBERTRUCK.value) == 3
+        assert kernels.first_block(lane, 0, 5, kernels.ACTIVE) == 2
+        assert kernels.first_block(lane, 3, 6, Block.OIL_ITEM.value) == 5
+        assert kernels.first_block(lane, 0, 5, Block.WALL.value) == -1
+        assert kernels.first_block(lane, 3, 3, kernels.ACTIVE) == -1
+
+    def test_map_lanes(self):
+        state_map = setup_states(1, map_type=CompactGlobalMap)[0].map
+        lanes = kernels.map_lanes(state_map)
+        assert kernels.map_lanes(state_map) is lanes
+
+        state_map[12, 2] = Block.WALL
+        assert kernels.map_lanes(state_map) is not lanes
+        assert kernels.map_lanes(state_map)[1][11] == Block.WALL.value
+        assert lanes[1][11] == state_map.global_map.raw(12, 2)
+
+    def test_set_engine(self):
+        try:
+            expected = 'numba' if kernels.JIT else 'python'
+            assert set_engine('numba') == expected
+            assert set_engine('numba', force=True) == 'numba'
+            assert set_engine('python') == 'python'
+
+            with pytest.raises(ValueError):
+                set_engine('java')
+        finally:
+            set_engine('python')
+
+# the kernels compiled by numba, rather than run as plain python
+@pytest.mark.skipif(not kernels.JIT, reason='requires numba')
+class TestCompiled:
+    @pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+    def test_engines_match(self, map_type):
+        states = setup_states(30, seed=1, map_type=map_type)
+        states[0].map[12, 2] = Block.WALL
+        states[1].map[20, 3] = Block.CYBERTRUCK
+
+        def run():
+            return [next_state_joint(state, cmd, opp_cmd)
+                    for state in states
+                    for cmd in valid_actions(state)
+                    for opp_cmd in valid_actions(state.switch())]
+
+        python = run()
+        try:
+            assert set_engine('numba') == 'numba'
+            walk_segment.cache_clear()
+            jit = run()
+        finally:
+            set_engine('python')
+            walk_segment.cache_clear()
+        assert python == jit
+
+    def test_kernels_match(self):
+        state_map = setup_states(1, map_type=CompactGlobalMap)[0].map
+        lane = kernels.map_lanes(state_map)[1]
+
+        for i1 in range(0, 30, 3):
+            for speed in [0, 3, 9, 15]:
+                args = (lane, i1, i1 + 10, speed, 2)
+                assert (kernels.walk_blocks(*args) ==
+                        kernels.walk_blocks.py_func(*args))
+            for code in [kernels.ACTIVE, Block.MUD.value, Block.WALL.value]:
+                args = (lane, i1, i1 + 10, code)
+                assert (kernels.first_block(*args) ==
+                        kernels.first_block.py_func(*args))
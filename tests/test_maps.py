@@ -1,9 +1,13 @@
+import pickle
+import random
 from copy import deepcopy
 
 import pytest
 
 from sloth.enums import Block
-from sloth.maps import BlockOverlay, GlobalMap, Map
+from sloth.maps import (BlockOverlay, GlobalMap, CompactGlobalMap, Map,
+                        BlockIndex, BAD_BLOCKS, SharedGlobalMap, shared_memory)
+from sloth.enums import RawBlock
 
 class TestBlockOverlay:
     def test_init(self):
@@ -62,6 +66,224 @@ class TestGlobalMap:
         with pytest.raises(IndexError):
             gmap[x + 1, y + 1]
 
+class TestCompactGlobalMap:
+    def setup_map(self):
+        x = 10
+        y = 4
+        return x, y, CompactGlobalMap(x, y)
+
+    def test_init(self):
+        x, y, gmap = self.setup_map()
+
+        assert gmap.min_x == 1
+        assert gmap.max_x == x
+        assert gmap.min_y == 1
+        assert gmap.max_y == y
+        assert type(gmap[1, 1]) is BlockOverlay
+        assert gmap[1, 1] == Block.EMPTY
+        assert gmap.raw(1, 1) == Block.EMPTY.value
+
+    def test_set_and_get(self):
+        x, y, gmap = self.setup_map()
+
+        gmap[1, 1] = Block.MUD
+        assert gmap[1, 1] == Block.MUD
+        assert gmap.raw(1, 1) == Block.MUD.value
+        gmap[x, y] = Block.BOOST
+        assert gmap[x, y] == Block.BOOST
+        assert gmap[x - 1, y] == Block.EMPTY
+
+        with pytest.raises(IndexError):
+            gmap[x + 1, y]
+        with pytest.raises(IndexError):
+            gmap[x, y + 1]
+        with pytest.raises(IndexError):
+            gmap.raw(0, y)
+        with pytest.raises(IndexError):
+            gmap[x + 1, y] = Block.MUD
+
+    def test_cybertruck(self):
+        x, y, gmap = self.setup_map()
+
+        gmap[9, 2] = Block.MUD
+        gmap.set_cybertruck(9, 2)
+        assert gmap[9, 2] == Block.CYBERTRUCK
+        assert gmap[9, 2].get_underlay() == Block.MUD
+        assert gmap.raw(9, 2) == Block.CYBERTRUCK.value
+        assert gmap[8, 2] == Block.EMPTY
+        assert gmap[10, 2] == Block.EMPTY
+
+        # setting an overlay keeps the cybertruck
+        gmap[9, 3] = gmap[9, 2]
+        assert gmap[9, 3] == Block.CYBERTRUCK
+
+        gmap[9, 2] = gmap[9, 2].get_underlay()
+        assert gmap[9, 2] == Block.MUD
+
+@pytest.mark.skipif(shared_memory is None, reason='requires python 3.8')
+class TestSharedGlobalMap:
+    @pytest.fixture
+    def gmap(self):
+        gmap = SharedGlobalMap(10, 4)
+        yield gmap
+        gmap.close()
+        gmap.unlink()
+
+    def test_attach(self, gmap):
+        gmap[3, 2] = Block.MUD
+        gmap.set_cybertruck(9, 4)
+
+        attached = SharedGlobalMap.attach(gmap.name)
+        assert attached[3, 2] == Block.MUD
+        assert attached.raw(9, 4) == Block.CYBERTRUCK.value
+        assert attached.version == gmap.version
+        assert attached.index is None
+
+        # changes made by the owner are visible straight away
+        gmap[4, 1] = Block.WALL
+        assert attached[4, 1] == Block.WALL
+        assert attached.version == gmap.version
+
+        with pytest.raises(TypeError):
+            attached[4, 1] = Block.EMPTY
+
+        attached.close()
+
+    def test_pickle(self, gmap):
+        gmap[5, 3] = Block.OIL_SPILL
+
+        data = pickle.dumps(gmap)
+        assert len(data) < 100
+
+        attached = pickle.loads(data)
+        assert attached.name == gmap.name
+        assert attached[5, 3] == Block.OIL_SPILL
+        attached.close()
+
+    def test_map_scans_without_index(self, gmap):
+        raw_map = [[{
+            'position': {'x': x, 'y': y},
+            'surfaceObject': (Block.MUD if x == 6 else Block.EMPTY).value,
+        } for x in range(1, 11)] for y in range(1, 5)]
+        Map(raw_map, gmap)
+
+        attached = SharedGlobalMap.attach(gmap.name)
+        m = Map([], attached)
+        assert m.count(2, 1, 10) == 1
+        assert m.first(3, 1, 10) == 6
+        attached.close()
+
+@pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+def test_raw_lane(map_type):
+    gmap = map_type(20, 4)
+    gmap[3, 2] = Block.MUD
+    gmap[5, 2] = Block.BOOST
+    gmap.set_cybertruck(5, 2)
+    gmap[4, 3] = Block.WALL
+
+    assert gmap.raw_lane(2, 2, 6) == [0, 1, 0, 100, 0]
+    assert gmap.raw_lane(2, 6, 5) == []
+
+    omap = Map([], gmap)
+    omap[4, 2] = Block.OIL_SPILL
+    assert omap.raw_lane(2, 2, 6) == [0, 1, 2, 100, 0]
+    assert omap.raw_lane(3, 4, 4) == [6]
+
+class TestBlockIndex:
+    @pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+    def test_count_and_first(self, map_type):
+        gmap = map_type(20, 4)
+        index = gmap.index
+
+        assert index.count(1, 1, 20) == 0
+        assert index.first(1, 1) is None
+
+        gmap[5, 1] = Block.MUD
+        gmap[9, 1] = Block.BOOST
+        gmap[12, 1] = Block.FINISH_LINE
+        gmap[15, 2] = Block.WALL
+
+        assert index.count(1, 1, 20) == 2
+        assert index.count(1, 6, 20) == 1
+        assert index.count(1, 1, 20, RawBlock.MUD) == 1
+        assert index.count(1, 1, 20, RawBlock.FINISH_LINE) == 1
+        assert index.count(2, 1, 20) == 1
+        assert index.first(1, 1) == 5
+        assert index.first(1, 5) == 5
+        assert index.first(1, 6) == 9
+        assert index.first(1, 6, end=8) is None
+        assert index.first(1, 10) is None
+        assert index.first(1, 1, RawBlock.BOOST) == 9
+
+        # overwriting and placing cybertrucks keep the counts up to date
+        gmap[5, 1] = Block.EMPTY
+        assert index.first(1, 1) == 9
+        gmap.set_cybertruck(3, 1)
+        assert index.first(1, 1) == 3
+        assert index.first(1, 1, RawBlock.CYBERTRUCK) == 3
+        gmap[3, 1] = gmap[3, 1].get_underlay()
+        assert index.first(1, 1, RawBlock.CYBERTRUCK) is None
+
+    def test_update(self):
+        index = BlockIndex(20, 4)
+        index.update(7, 2, RawBlock.EMPTY, RawBlock.MUD)
+        index.update(3, 2, RawBlock.EMPTY, RawBlock.OIL_SPILL)
+
+        assert index.count(2, 1, 20) == 2
+        assert index.count(2, 4, 20, RawBlock.MUD) == 1
+        assert index.first(2, 4) == 7
+        assert index.first(2, 1, RawBlock.OIL_SPILL) == 3
+
+        index.update(3, 2, RawBlock.OIL_SPILL, RawBlock.FINISH_LINE)
+        assert index.count(2, 1, 20) == 1
+        assert index.first(2, 1) == 7
+        assert index.first(2, 1, RawBlock.FINISH_LINE) == 3
+
+    # compares the trees against a plain list of blocks
+    def test_random_updates(self):
+        rng = random.Random(0)
+        codes = [RawBlock.EMPTY, RawBlock.MUD, RawBlock.WALL, RawBlock.BOOST,
+                 RawBlock.FINISH_LINE, RawBlock.CYBERTRUCK]
+        index = BlockIndex(50, 1)
+        lane = [RawBlock.EMPTY] * 51
+
+        for _ in range(200):
+            x = rng.randint(1, 50)
+            new = rng.choice(codes)
+            index.update(x, 1, lane[x], new)
+            lane[x] = new
+
+            x1 = rng.randint(1, 50)
+            x2 = rng.randint(x1, 50)
+            code = rng.choice(codes[1:])
+            assert index.count(1, x1, x2, code) == lane[x1:x2 + 1].count(code)
+
+            active = [x for x in range(x1, 51) if lane[x] not in
+                      (RawBlock.EMPTY, RawBlock.FINISH_LINE)]
+            assert index.first(1, x1) == (active[0] if active else None)
+
+    def test_overlay_set_cybertruck(self):
+        gmap = GlobalMap(20, 4)
+        gmap[4, 3].set_cybertruck()
+        assert gmap.index.first(3, 1, RawBlock.CYBERTRUCK) == 4
+
+    def test_map_count_and_first(self):
+        gmap = GlobalMap(20, 4)
+        omap = Map(raw_map=[[]], global_map=gmap)
+        gmap[5, 1] = Block.MUD
+        gmap[9, 1] = Block.WALL
+
+        assert omap.first(1, 1, 20) == 5
+        assert omap.count(1, 1, 20, BAD_BLOCKS) == 2
+
+        # changes in the view take precedence over the global map
+        omap[5, 1] = Block.EMPTY
+        omap[7, 1] = Block.OIL_SPILL
+        assert omap.first(1, 1, 20) == 7
+        assert omap.count(1, 1, 20, BAD_BLOCKS) == 2
+        assert omap.count(1, 1, 20, (RawBlock.OIL_SPILL,)) == 1
+        assert omap.first(1, 10, 20) is None
+
 class TestMap:
     def setup_gmap(self):
         x = 10
@@ -130,6 +352,48 @@ class TestMap:
         assert copy.view is not omap.view
         assert copy.global_map is omap.global_map
 
+    def test_copy_on_write(self):
+        x, y, gmap = self.setup_gmap()
+        omap = Map(raw_map=[[]], global_map=gmap)
+        omap[1, 1] = Block.MUD
+
+        copy = omap.copy()
+        assert copy == omap
+        assert hash(copy) == hash(omap)
+
+        copy[2, 1] = Block.WALL
+        omap[3, 1] = Block.BOOST
+        assert copy[1, 1] == Block.MUD
+        assert copy[2, 1] == Block.WALL
+        assert copy[3, 1] == Block.EMPTY
+        assert omap[2, 1] == Block.EMPTY
+        assert omap[3, 1] == Block.BOOST
+        assert copy != omap
+
+        # long chains of copies still see all of their parents' writes
+        cur = copy
+        for i in range(1, x + 1):
+            cur = cur.copy()
+            cur[i, 4] = Block.OIL_SPILL
+        for i in range(1, x + 1):
+            assert cur[i, 4] == Block.OIL_SPILL
+        assert cur[1, 1] == Block.MUD
+        assert cur[2, 1] == Block.WALL
+        assert len(cur.view) == x + 2
+
+        # the hash only depends on the view's contents, not its history
+        other = Map(raw_map=[[]], global_map=gmap)
+        other[2, 1] = Block.EMPTY
+        other[1, 1] = Block.MUD
+        other[2, 1] = Block.WALL
+        assert other == copy
+        assert hash(other) == hash(copy)
+
+        copy.update_global_map()
+        assert gmap[2, 1] == Block.WALL
+        assert copy.view == {}
+        assert omap[2, 1] == Block.WALL
+
     def test_cybertruck(self):
         x, y, gmap = self.setup_gmap()
 
@@ -145,5 +409,7 @@ class TestMap:
         ])
 
         assert omap[1, 1] == Block.CYBERTRUCK
+        assert omap.raw(1, 1) == Block.CYBERTRUCK.value
         omap[1, 1] = omap[1, 1].get_underlay()
         assert omap[1, 1] == Block.MUD
+        assert omap.raw(1, 1) == Block.MUD.value
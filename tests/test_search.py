@@ -1,4 +1,12 @@
+import time
+import types
+
+import pytest
+
 from sloth.search import search, opp_search, Weights, score, offensive_search
+from sloth.search import dfs_search, search_depth, search_stats, undominated
+from sloth.search import SearchTimeout, beam_search, select_beam
+from sloth import search as search_module
 from sloth.state import Player, State, next_state, valid_actions
 from sloth.maps import GlobalMap, Map
 from sloth.enums import Cmd, Speed, Block
@@ -67,6 +75,242 @@ class TestSearch:
                 cur_state = next_state(cur_state, action, pred(cur_state))
             assert cur_state == final_state
 
+    @pytest.mark.parametrize('speed,depth', [
+        (Speed.SPEED_1.value, 0), (Speed.SPEED_1.value, 3),
+        (Speed.SPEED_3.value, 4), (Speed.MAX_SPEED.value, 3),
+        (Speed.BOOST_SPEED.value, 4),
+    ])
+    def test_dfs_search(self, speed, depth):
+        state = setup_state()
+        state.player.speed = speed
+        state.map[5, 1] = Block.MUD
+        state.map[8, 2] = Block.WALL
+        state.map[6, 3] = Block.BOOST
+        opp_pred = lambda s: Cmd.ACCEL
+
+        options = dfs_search(state, opp_pred, depth)
+        assert list(options) == search(state, opp_pred, depth)
+
+    # every node is expanded once, with a single opponent prediction
+    def test_dfs_search_single_pass(self):
+        state = setup_state()
+        calls = []
+
+        def opp_pred(s):
+            calls.append(s)
+            return Cmd.ACCEL
+
+        next_state.cache_clear()
+        options = dfs_search(state, opp_pred, 3)
+        assert len(options[0][0]) == 3
+
+        pred = lambda s: Cmd.ACCEL
+        internal = 1 + len(search(state, pred, 1)) + len(search(state, pred, 2))
+        assert len(calls) == internal
+
+    def test_search_depth(self):
+        state = setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+
+        # can't reach the end of the view within 3 moves at speed 3
+        assert search_depth(state, opp_pred, 3) == 3
+
+        # boosting immediately takes us past the view
+        state.player.speed = Speed.BOOST_SPEED.value
+        assert search_depth(state, opp_pred, 4) == 2
+        state.player.x = state.map.max_x
+        assert search_depth(state, opp_pred, 4) == 0
+
+    @pytest.mark.parametrize('split_first', [False, True])
+    @pytest.mark.parametrize('depth', [2, 3, 4])
+    def test_transpositions(self, depth, split_first):
+        state = setup_state()
+        state.map[5, 1] = Block.MUD
+        state.map[6, 3] = Block.BOOST
+        opp_pred = lambda s: Cmd.ACCEL
+
+        # merging keeps the first sequence that leads to each final state
+        expected = []
+        found = set()
+        for actions, final_state in search(state, opp_pred, depth):
+            key = (actions[0] if split_first else None, final_state)
+            if key not in found:
+                found.add(key)
+                expected.append((actions, final_state))
+
+        search_stats.clear()
+        options = list(dfs_search(state, opp_pred, depth, transpositions=True,
+                                  split_first=split_first))
+        assert options == expected
+
+    # saved counts the next_state cache misses that merging avoided, which
+    # only happens once the merged subtree's transitions have been evicted
+    def test_transpositions_saved(self):
+        state = setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+        maxsize = next_state.maxsize
+
+        try:
+            for size, evicted in [(maxsize, False), (1, True)]:
+                next_state.cache_clear()
+                next_state.resize(size)
+                search_stats.clear()
+                dfs_search(state, opp_pred, 3, transpositions=True)
+                assert search_stats['merged'] > 0
+                assert (search_stats['saved'] > 0) == evicted
+        finally:
+            next_state.resize(maxsize)
+
+    def test_transpositions_merge_order(self):
+        state = setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+
+        # turning before or after going straight ends up in the same state
+        search_stats.clear()
+        options = [a for a, _ in dfs_search(state, opp_pred, 2,
+                                            transpositions=True)]
+        assert [Cmd.NOP, Cmd.RIGHT] in options
+        assert [Cmd.RIGHT, Cmd.NOP] not in options
+        assert search_stats['merged'] > 0
+
+        options = [a for a, _ in dfs_search(state, opp_pred, 2,
+                                            transpositions=True,
+                                            split_first=True)]
+        assert [Cmd.RIGHT, Cmd.NOP] in options
+
+    def test_deadline(self):
+        state = setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+
+        with pytest.raises(SearchTimeout):
+            list(dfs_search(state, opp_pred, 3, deadline=time.monotonic()))
+
+        options = dfs_search(state, opp_pred, 3,
+                             deadline=time.monotonic() + 60)
+        assert list(options) == search(state, opp_pred, 3)
+
+        with pytest.raises(SearchTimeout):
+            opp_search(state, deadline=time.monotonic())
+
+    # the deadline is checked while walking the tree and not only up front.
+    # uses a fake clock that passes the deadline after the 10th prediction
+    def test_deadline_inside_search(self, monkeypatch):
+        state = setup_state()
+        calls = []
+
+        def opp_pred(s):
+            calls.append(s)
+            return Cmd.ACCEL
+
+        clock = lambda: 0 if len(calls) < 10 else 2
+        monkeypatch.setattr(search_module, 'time',
+                            types.SimpleNamespace(monotonic=clock))
+
+        with pytest.raises(SearchTimeout):
+            list(dfs_search(state, opp_pred, 4, deadline=1))
+        assert len(calls) == 10
+
+class TestBeamSearch:
+    weights = Weights({
+        'pos': 1,
+        'speed': 2,
+        'boosts': 10,
+        'damage': -5,
+        'next_state': 0.5,
+    })
+
+    def setup_state(self):
+        state = setup_state()
+        state.map[5, 1] = Block.MUD
+        state.map[13, 2] = Block.WALL
+        state.map[6, 3] = Block.BOOST
+        return state
+
+    # a wide enough beam keeps everything
+    def test_full_width(self):
+        state = self.setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+
+        full = search(state, opp_pred, 3)
+        beam = beam_search(state, opp_pred, 3, self.weights, width=10000)
+
+        assert sorted(beam, key=lambda o: o[0]) == sorted(full,
+                                                          key=lambda o: o[0])
+        assert (score(beam, state, self.weights, opp_pred) ==
+                score(full, state, self.weights, opp_pred))
+
+    def test_width(self):
+        state = self.setup_state()
+        opp_pred = lambda s: Cmd.ACCEL
+
+        beam = beam_search(state, opp_pred, 3, self.weights, width=3)
+        assert len(beam) == 3
+        assert all(len(actions) == 3 for actions, _ in beam)
+
+        # the beam is ranked and each option is valid
+        full = search(state, opp_pred, 3)
+        assert all(option in full for option in beam)
+        assert score(beam, state, self.weights, opp_pred) == beam[0][0]
+
+    def test_stops_outside_view(self):
+        state = self.setup_state()
+        state.player.speed = Speed.BOOST_SPEED.value
+        opp_pred = lambda s: Cmd.ACCEL
+
+        beam = beam_search(state, opp_pred, 4, self.weights, width=4)
+        assert all(len(actions) == 2 for actions, _ in beam)
+
+
+    # options that leave the view stop the search even if they don't make it
+    # into the beam
+    def test_stops_outside_view_pruned(self):
+        state = setup_state()
+        state.player.speed = Speed.MAX_SPEED.value
+        state.player.x = state.map.max_x - Speed.MAX_SPEED.value
+        opp_pred = lambda s: Cmd.ACCEL
+
+        beam = beam_search(state, opp_pred, 4, Weights({'pos': -1}), width=1)
+        assert [len(actions) for actions, _ in beam] == [1]
+        assert beam[0][1].player.x < state.map.max_x
+
+    # expands fewer nodes than the full search, so within the same budget of
+    # expanded nodes it gets deeper
+    def test_deeper_within_budget(self):
+        state = self.setup_state()
+        calls = []
+
+        def opp_pred(s):
+            calls.append(s)
+            return Cmd.ACCEL
+
+        beam = beam_search(state, opp_pred, 6, self.weights, width=4)
+        budget = len(calls)
+        beam_depth = len(beam[0][0])
+
+        full_depth = 0
+        for depth in range(1, 7):
+            calls.clear()
+            full = search(state, opp_pred, depth)
+            if len(calls) > budget:
+                break
+            full_depth = len(full[0][0])
+
+        assert beam_depth == 3
+        assert full_depth < beam_depth
+
+    def test_select_beam(self):
+        states = [setup_state() for _ in range(4)]
+        for y, state in zip([1, 1, 2, 3], states):
+            state.player.y = y
+        options = [([cmd], state) for cmd, state in
+                   zip([Cmd.NOP, Cmd.ACCEL, Cmd.LEFT, Cmd.RIGHT], states)]
+        key = lambda o: {Cmd.NOP: 3, Cmd.ACCEL: 4, Cmd.LEFT: 2,
+                         Cmd.RIGHT: 1}[o[0][0]]
+
+        assert select_beam(options, key, 2) == [options[1], options[0]]
+        assert select_beam(options, key, 2, per_lane=True) == [
+            options[1], options[0], options[2], options[3]]
+
 class TestScore:
     def test_score_normal(self):
         state = setup_state()
@@ -116,6 +360,72 @@ class TestScore:
 
         assert score(options, state, weights) == chosen[0]
 
+class TestDominance:
+    weights = Weights({
+        'pos': 1,
+        'speed': 2,
+        'boosts': 10,
+        'damage': -5,
+    })
+
+    def test_dominates(self):
+        a = setup_state()
+        b = setup_state()
+        assert not self.weights.dominates(a, b)
+
+        b.player.x -= 1
+        b.player.damage += 1
+        assert self.weights.dominates(a, b)
+        assert not self.weights.dominates(b, a)
+
+        # trading position for speed isn't dominated
+        b.player.speed += 1
+        assert not self.weights.dominates(a, b)
+
+    @pytest.mark.parametrize('attr,delta', [
+        ('y', 1), ('boosting', True), ('boost_counter', 1), ('oils', 1),
+        ('lizards', -1),
+    ])
+    def test_equal_fields(self, attr, delta):
+        a = setup_state()
+        b = setup_state()
+        b.player.x -= 1
+        setattr(b.player, attr, getattr(b.player, attr) + delta)
+        assert not self.weights.dominates(a, b)
+
+    def test_opponent_must_match(self):
+        a = setup_state()
+        b = setup_state()
+        b.player.x -= 1
+        b.opponent.x += 1
+        assert not self.weights.dominates(a, b)
+
+    def test_undominated(self):
+        states = [setup_state() for _ in range(3)]
+        states[1].player.speed -= 1
+        options = list(zip([Cmd.NOP, Cmd.ACCEL, Cmd.DECEL], states))
+
+        search_stats.clear()
+        assert undominated(self.weights, options) == [options[0], options[2]]
+        assert search_stats['dominated'] == 1
+
+    def test_pruned_search(self):
+        state = setup_state()
+        state.map[5, 1] = Block.MUD
+        state.map[13, 1] = Block.MUD
+        state.map[11, 2] = Block.WALL
+        opp_pred = lambda s: Cmd.ACCEL
+
+        full = search(state, opp_pred, 3)
+        search_stats.clear()
+        pruned = list(dfs_search(state, opp_pred, 3, prune=self.weights))
+
+        assert search_stats['dominated'] > 0
+        assert len(pruned) < len(full)
+        assert all(option in full for option in pruned)
+        assert (score(pruned, state, self.weights) ==
+                score(full, state, self.weights))
+
 class TestOffensiveSearch:
     def test_nop(self):
         state = setup_state()
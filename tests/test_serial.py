@@ -0,0 +1,90 @@
+import pytest
+
+from sloth.serial import encode_state, decode_state, FORMAT_VERSION
+from sloth.state import Player, State
+from sloth.maps import GlobalMap, CompactGlobalMap, Map
+from sloth.enums import Block
+
+def setup_state(global_map):
+    raw_map = [[{
+        'position': {
+            'x': x,
+            'y': y,
+        },
+        'surfaceObject': Block.EMPTY.value,
+        'isOccupiedByCyberTruck': False,
+    } for x in range(1, 22)] for y in range(1, 5)]
+
+    state = State()
+    state.map = Map(raw_map, global_map)
+    state.player = Player({
+        'id': 1,
+        'position': {'x': 4, 'y': 2},
+        'speed': 8,
+        'powerups': ['BOOST', 'OIL', 'OIL', 'TWEET'],
+        'boosting': True,
+        'boostCounter': 3,
+        'damage': 1,
+        'score': -12,
+    })
+    state.opponent = Player({
+        'id': 2,
+        'position': {'x': 19, 'y': 4},
+        'speed': 3,
+    })
+    return state
+
+@pytest.mark.parametrize('map_type', [GlobalMap, CompactGlobalMap])
+class TestSerial:
+    def test_round_trip(self, map_type):
+        global_map = map_type(1500, 4)
+        state = setup_state(global_map)
+        state.map[5, 1] = Block.MUD
+        state.map[6, 3] = Block.OIL_SPILL
+        state.map.move_window(4, 8)
+
+        data = encode_state(state)
+        decoded = decode_state(data, global_map)
+
+        assert decoded == state
+        assert hash(decoded) == hash(state)
+        assert decoded.map.global_map is global_map
+        assert ((decoded.map.min_x, decoded.map.max_x) ==
+                (state.map.min_x, state.map.max_x))
+        assert decoded.player.score == -12
+        assert decoded.player.boosting
+
+    def test_overlays(self, map_type):
+        global_map = map_type(1500, 4)
+        state = setup_state(global_map)
+        state.map[7, 2] = Block.BOOST
+        state.map[7, 2].set_cybertruck()
+
+        decoded = decode_state(encode_state(state), global_map)
+        assert decoded.map[7, 2] == Block.CYBERTRUCK
+        assert decoded.map[7, 2].get_underlay() == Block.BOOST
+
+    def test_size(self, map_type):
+        state = setup_state(map_type(1500, 4))
+        assert len(encode_state(state)) < 64
+
+        state.map[5, 1] = Block.MUD
+        assert len(encode_state(state)) < 72
+
+    def test_global_map_version(self, map_type):
+        global_map = map_type(1500, 4)
+        data = encode_state(setup_state(global_map))
+
+        global_map[3, 3] = Block.WALL
+        with pytest.raises(ValueError):
+            decode_state(data, global_map)
+        with pytest.raises(ValueError):
+            decode_state(data, map_type(1500, 4))
+
+    def test_format_version(self, map_type):
+        global_map = map_type(1500, 4)
+        data = bytearray(encode_state(setup_state(global_map)))
+        data[0] = FORMAT_VERSION + 1
+
+        with pytest.raises(ValueError):
+            decode_state(bytes(data), global_map)
@@ -1,4 +1,10 @@
-from sloth.state import Player, State, valid_actions, next_state, calc_opp_cmd
+from sloth.state import (Player, State, valid_actions, next_state, calc_opp_cmd,
+                         next_state_joint, may_interact, walk_segment,
+                         may_collide, collision_stats, Trajectory,
+                         valid_player_actions, opp_cmd_candidates,
+                         intern_state, calc_trajectory, MOVE_TEMPLATES,
+                         TRAJECTORIES)
+from sloth import state as state_module
 from sloth.maps import GlobalMap, Map
 from sloth.enums import (Block, Speed, Cmd, prev_speed, next_speed, max_speed,
                          boost_speed)
@@ -97,6 +103,21 @@ class TestPlayer:
         assert hash(player1) == hash(player2)
         assert player1 == player2
 
+    def test_incremental_hash(self):
+        player1 = self.setup_player()
+        player2 = self.setup_player()
+
+        player1.x += 5
+        player1.boosting = True
+        assert hash(player1) != hash(player2)
+        assert player1 != player2
+
+        player1.x -= 5
+        player1.boosting = False
+        assert hash(player1) == hash(player2)
+        assert player1 == player2
+        assert hash(player1.copy()) == hash(player1)
+
 class TestState:
     def test_switch(self):
         player = Player({
@@ -120,8 +141,9 @@ class TestState:
         class TmpMap:
             def __init__(self):
                 self.called = False
-            def move_window(self, *args):
+            def window(self, *args):
                 self.called = True
+                return self
 
         state = State()
         state.player = player
@@ -131,10 +153,51 @@ class TestState:
         switch = state.switch()
 
         assert switch is not state
-        assert switch.player == state.opponent
-        assert switch.opponent == state.player
+        assert switch.player is state.opponent
+        assert switch.opponent is state.player
         assert switch.map.called == True
 
+    def test_switch_window(self):
+        state = setup_state()
+        state.opponent.x = 5
+        state.map[3, 1] = Block.MUD
+
+        switch = state.switch()
+
+        assert switch.map is not state.map
+        assert switch.map.min_x == state.map.min_x + 4
+        assert switch.map.max_x == state.map.max_x + 4
+        assert switch.map[3, 1] == Block.MUD
+
+        # the original's view isn't affected by the switched one
+        switch.map[4, 1] = Block.OIL_SPILL
+        assert state.map[4, 1] == Block.EMPTY
+
+    def test_copy(self):
+        state = setup_state()
+        state.map[2, 1] = Block.MUD
+
+        cp = state.copy()
+
+        assert cp is not state
+        assert cp == state
+        assert cp.player is not state.player
+        assert cp.opponent is not state.opponent
+        assert cp.map.view is not state.map.view
+        assert cp.map.global_map is state.map.global_map
+
+        assert hash(cp) == hash(state)
+
+        cp.player, cp.opponent = cp.opponent, cp.player
+        assert hash(cp) != hash(state)
+        cp.player, cp.opponent = cp.opponent, cp.player
+
+        cp.player.x += 1
+        cp.map[3, 1] = Block.WALL
+        assert state.player.x == cp.player.x - 1
+        assert state.map[3, 1] == Block.EMPTY
+        assert cp != state
+
 def setup_state():
     player = Player({
         'id': 1,
@@ -1190,6 +1253,306 @@ class TestNextState:
             assert cur.damage == prev.damage - 2
             assert nstate.map[prev.x, prev.y] == Block.CYBERTRUCK
 
+class TestWalkSegment:
+    def test_global_map_change(self):
+        state = setup_state()
+        y, start, end = state.player.y, 2, 9
+        speed, damage = Speed.MAX_SPEED.value, 0
+
+        outcome = walk_segment(state.map, y, start, end, speed, damage)
+        assert outcome[0] == speed
+        assert outcome[6] == 0
+
+        # changes to the global map and the view invalidate the cached outcome
+        state.map.global_map[5, y] = Block.MUD
+        outcome = walk_segment(state.map, y, start, end, speed, damage)
+        assert outcome[0] == Speed.SPEED_3.value
+        assert outcome[6] == 1
+
+        state.map[6, y] = Block.WALL
+        outcome = walk_segment(state.map, y, start, end, speed, damage)
+        assert outcome[0] == Speed.SPEED_1.value
+        assert outcome[6] == 2
+        assert outcome[-1] == -8
+
+class TestDecoupledNextState:
+    def test_may_interact(self):
+        state = setup_state()
+        player, opp = state.player, state.opponent
+
+        # far apart
+        player.x, opp.x = 1, 30
+        assert not may_interact(player, opp, Cmd.ACCEL, Cmd.NOP)
+
+        # close together but in lanes they can't both reach
+        player.x, opp.x = 1, 2
+        player.y, opp.y = 1, 4
+        assert not may_interact(player, opp, Cmd.RIGHT, Cmd.LEFT)
+        player.y, opp.y = 2, 4
+        assert may_interact(player, opp, Cmd.RIGHT, Cmd.LEFT)
+
+        # same lane, opponent in front
+        player.y, opp.y = 1, 1
+        player.x, opp.x = 1, 1 + player.speed + 2
+        assert not may_interact(player, opp, Cmd.NOP, Cmd.NOP)
+        assert may_interact(player, opp, Cmd.ACCEL, Cmd.NOP)
+
+    def test_matches_joint(self):
+        state = setup_state()
+        state.player.lizards = 1
+        state.opponent.x = 12
+        state.opponent.y = 2
+        state.map[5, 1] = Block.MUD
+        state.map[14, 2] = Block.BOOST
+        state.map[18, 3].set_cybertruck()
+
+        for cmd in valid_actions(state):
+            for opp_cmd in valid_actions(state.switch()):
+                assert (next_state(state, cmd, opp_cmd) ==
+                        next_state_joint(state, cmd, opp_cmd))
+
+class TestCollisionFastPath:
+    def test_may_collide(self):
+        state = setup_state()
+        player, opp = state.player, state.opponent
+        traj, opp_traj = Trajectory(0), Trajectory(0)
+        traj.x_off, opp_traj.x_off = 5, 2
+
+        # same lane, overlapping x-intervals
+        player.x, opp.x = 1, 4
+        player.y, opp.y = 1, 1
+        assert may_collide(player, opp, traj, opp_traj)
+
+        # opponent out of reach
+        opp.x = 7
+        assert not may_collide(player, opp, traj, opp_traj)
+
+        # ending in different lanes
+        opp.x = 4
+        opp_traj.y_off = 1
+        assert not may_collide(player, opp, traj, opp_traj)
+
+        # ending in the same lane from different lanes
+        opp.y = 0
+        assert may_collide(player, opp, traj, opp_traj)
+
+        # stopped behind a cybertruck while turning
+        player.x, opp.x = 4, 4
+        traj.x_off, opp_traj.x_off = -1, -1
+        player.y, opp.y = 1, 0
+        assert may_collide(player, opp, traj, opp_traj)
+
+    def test_matches_full_check(self, monkeypatch):
+        state = setup_state()
+        state.player.lizards = 1
+        state.opponent.x = 6
+        state.opponent.y = 2
+        state.map[5, 1] = Block.MUD
+        state.map[9, 2].set_cybertruck()
+
+        cmds = [(cmd, opp_cmd) for cmd in valid_actions(state)
+                for opp_cmd in valid_actions(state.switch())]
+        fast = [next_state_joint(state, *c) for c in cmds]
+
+        monkeypatch.setattr(state_module, 'may_collide', lambda *args: True)
+        for c, nstate in zip(cmds, fast):
+            assert nstate == next_state_joint(state, *c)
+
+    def test_stats(self):
+        state = setup_state()
+        state.opponent.x = 5
+        state.opponent.y = 4
+
+        checked = collision_stats['checked']
+        skipped = collision_stats['skipped']
+        next_state_joint(state, Cmd.NOP, Cmd.NOP)
+        assert collision_stats['checked'] == checked
+        assert collision_stats['skipped'] == skipped + 1
+
+        state.opponent.y = 1
+        next_state_joint(state, Cmd.ACCEL, Cmd.NOP)
+        assert collision_stats['checked'] == checked + 1
+
+class TestInterning:
+    def test_equal_states_interned(self):
+        state = setup_state()
+        state.player.y = 2
+        state.opponent.x = 30
+
+        # two ways of ending up in the same state
+        a = next_state(next_state(state, Cmd.LEFT, Cmd.NOP), Cmd.RIGHT,
+                       Cmd.NOP)
+        b = next_state(next_state(state, Cmd.RIGHT, Cmd.NOP), Cmd.LEFT,
+                       Cmd.NOP)
+        assert a is b
+
+        # the opponent did the same in both
+        c = next_state(next_state(state, Cmd.NOP, Cmd.NOP), Cmd.NOP, Cmd.NOP)
+        assert c is not a
+        assert c.opponent is a.opponent
+
+    def test_global_maps_kept_apart(self):
+        state = setup_state()
+        other = state.copy()
+        other.map.global_map = GlobalMap(1500, 4)
+
+        assert intern_state(state) is state
+        assert intern_state(state.copy()) is state
+        assert intern_state(other) is other
+
+class TestOffensiveCmds:
+    def test_oil(self):
+        state = setup_state()
+        state.player.oils = 2
+        state.opponent.x = 30
+
+        nstate = next_state(state, Cmd.OIL, Cmd.NOP)
+        assert nstate.player.x == state.player.x + state.player.speed
+        assert nstate.player.oils == 1
+        assert nstate.player.score == 4
+        assert nstate.map[state.player.x, state.player.y] == Block.OIL_SPILL
+        assert state.map[state.player.x, state.player.y] == Block.EMPTY
+
+    def test_tweet(self):
+        state = setup_state()
+        state.player.tweets = 1
+        state.player.x = 20
+        state.opponent.x = 2
+        state.opponent.y = 2
+
+        tweet = Cmd(Cmd.TWEET, pos=(14, 2))
+        nstate = next_state(state, tweet, Cmd.NOP)
+        assert nstate.player.tweets == 0
+        assert nstate.player.score == 4
+        assert nstate.map[14, 2] == Block.CYBERTRUCK
+        assert state.map.global_map[14, 2] == Block.EMPTY
+
+        # placed after moving, so the opponent only hits it next round
+        assert nstate.opponent.x == 10
+        nnstate = next_state(nstate, Cmd.NOP, Cmd.NOP)
+        assert nnstate.opponent.x == 13
+        assert nnstate.map[14, 2] == Block.EMPTY
+
+    def test_tweet_twice(self):
+        state = setup_state()
+        state.player.tweets = 2
+        state.player.x = 20
+        state.opponent.x = 2
+        state.opponent.y = 2
+
+        nstate = next_state(state, Cmd(Cmd.TWEET, pos=(30, 2)), Cmd.NOP)
+        nnstate = next_state(nstate, Cmd(Cmd.TWEET, pos=(32, 3)), Cmd.NOP)
+        assert nnstate.player.tweets == 0
+        assert nnstate.map[30, 2] == Block.EMPTY
+        assert nnstate.map[32, 3] == Block.CYBERTRUCK
+        assert nstate.map[30, 2] == Block.CYBERTRUCK
+
+    def test_tweet_removes_placed(self):
+        state = setup_state()
+        state.player.tweets = 1
+        state.opponent.x = 30
+        state.map.global_map.set_cybertruck(14, 2)
+        state.map.cybertrucks = {state.player.id: (14, 2)}
+
+        nstate = next_state(state, Cmd(Cmd.TWEET, pos=(16, 3)), Cmd.NOP)
+        assert nstate.map[14, 2] == Block.EMPTY
+        assert nstate.map[16, 3] == Block.CYBERTRUCK
+        assert state.map.global_map[14, 2] == Block.CYBERTRUCK
+
+    def test_tweet_off_map(self):
+        state = setup_state()
+        state.player.tweets = 1
+        state.opponent.x = 30
+        max_x = state.map.global_map.max_x
+
+        tweet = Cmd(Cmd.TWEET, pos=(max_x + 3, 3))
+        nstate = next_state(state, tweet, Cmd.NOP)
+        assert nstate.player.tweets == 0
+        assert nstate.map == next_state(state, Cmd.NOP, Cmd.NOP).map
+
+    def test_emp_hit(self):
+        state = setup_state()
+        state.player.emps = 1
+        state.opponent.x = 10
+        state.opponent.y = 2
+        state.opponent.boosts = 1
+
+        nstate = next_state(state, Cmd.EMP, Cmd.BOOST)
+        assert nstate.player.emps == 0
+        assert nstate.player.score == 4
+        assert (nstate.opponent.x, nstate.opponent.y) == (10, 2)
+        assert nstate.opponent.speed == Speed.SPEED_1.value
+        assert not nstate.opponent.boosting
+        assert nstate.opponent.boosts == 0
+
+    def test_emp_miss(self):
+        state = setup_state()
+        state.player.emps = 1
+        state.player.x = 10
+        state.opponent.x = 5
+        state.opponent.y = 2
+
+        # opponent is behind
+        nstate = next_state(state, Cmd.EMP, Cmd.NOP)
+        assert nstate.opponent.x == 5 + state.opponent.speed
+        assert nstate.player.emps == 0
+
+        # opponent is too far to the side
+        state.player.x = 1
+        state.opponent.y = 3
+        nstate = next_state(state, Cmd.EMP, Cmd.NOP)
+        assert nstate.opponent.x == 5 + state.opponent.speed
+
+    def test_matches_joint(self):
+        state = setup_state()
+        state.player.oils = 1
+        state.player.emps = 1
+        state.opponent.tweets = 1
+        state.opponent.x = 12
+        state.opponent.y = 2
+
+        cmds = [Cmd.OIL, Cmd.EMP, Cmd.NOP, Cmd.ACCEL]
+        opp_cmds = [Cmd(Cmd.TWEET, pos=(20, 3)), Cmd.NOP, Cmd.RIGHT]
+        for cmd in cmds:
+            for opp_cmd in opp_cmds:
+                assert (next_state(state, cmd, opp_cmd) ==
+                        next_state_joint(state, cmd, opp_cmd))
+
+class TestMoveTemplates:
+    def test_trajectories(self):
+        player = setup_state().player
+        for damage in range(6):
+            for speed in range(16):
+                player.damage = damage
+                player.speed = speed
+                for cmd in Cmd.CmdEnum:
+                    traj = calc_trajectory(player, cmd)
+                    assert ((traj.x_off, traj.y_off, traj.speed) ==
+                            TRAJECTORIES[damage][speed][cmd])
+
+        player.damage, player.speed = 0, 5
+        traj = calc_trajectory(player, Cmd(Cmd.TWEET, pos=(3, 1)))
+        assert (traj.x_off, traj.y_off, traj.speed) == (5, 0, 5)
+
+    def test_templates(self):
+        state = setup_state()
+        state.player.y = 2
+        state.player.lizards = 1
+        state.player.boosts = 1
+        state.player.damage = 1
+
+        key = (state.player.speed, 1, True, True, False, True, True)
+        assert MOVE_TEMPLATES[key] == valid_actions(state)
+        assert MOVE_TEMPLATES[key] == (Cmd.ACCEL, Cmd.NOP, Cmd.DECEL, Cmd.LEFT,
+                                       Cmd.RIGHT, Cmd.LIZARD, Cmd.FIX,
+                                       Cmd.BOOST)
+
+    def test_outside_table(self):
+        state = setup_state()
+        state.player.speed = 20
+        assert Cmd.NOP in valid_actions(state)
+        assert calc_trajectory(state.player, Cmd.NOP).x_off == 20
+
 class TestCalcOppCmd:
     def test_valid_cmds(self):
         state = setup_state()
@@ -1201,3 +1564,31 @@ class TestCalcOppCmd:
         for action in valid_actions(state.switch()):
             nstate = next_state(state, Cmd.NOP, action)
             assert calc_opp_cmd(Cmd.NOP, state, nstate) == action
+
+    def test_valid_player_actions(self):
+        state = setup_state()
+        state.opponent.y = 3
+        state.opponent.boosts = 1
+        state.opponent.damage = 1
+
+        assert (valid_player_actions(state.opponent, state.map) ==
+                valid_actions(state.switch()))
+
+    def test_candidates(self):
+        state = setup_state()
+        opp = state.opponent
+        speed = opp.speed
+
+        # a straight move could have been cut short from a longer one
+        assert opp_cmd_candidates(opp, speed, 0, speed) == {Cmd.NOP,
+                                                            Cmd.LIZARD,
+                                                            Cmd.ACCEL,
+                                                            Cmd.BOOST}
+        assert opp_cmd_candidates(opp, speed - 1, -1, speed) == {Cmd.LEFT}
+
+        # a turn that ended on the other player's block
+        assert Cmd.RIGHT in opp_cmd_candidates(opp, speed - 2, 0, speed)
+
+        # nothing could have sped them up this much
+        too_fast = Speed.BOOST_SPEED.value + 1
+        assert not opp_cmd_candidates(opp, speed, 0, too_fast)
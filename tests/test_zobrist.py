@@ -0,0 +1,32 @@
+from sloth import zobrist
+
+class TestZobrist:
+    def test_order_independent(self):
+        args = [('x', 5), ('speed', 9), (3, 2, 1)]
+        saved = dict(zobrist._keys)
+        try:
+            zobrist._keys.clear()
+            forward = [zobrist.key(*a) for a in args]
+            zobrist._keys.clear()
+            backward = [zobrist.key(*a) for a in reversed(args)]
+        finally:
+            zobrist._keys.clear()
+            zobrist._keys.update(saved)
+
+        assert forward == backward[::-1]
+        assert len(set(forward)) == len(forward)
+
+    def test_equal_values(self):
+        saved = dict(zobrist._keys)
+        try:
+            zobrist._keys.clear()
+            k = zobrist.key('boosting', True)
+            zobrist._keys.clear()
+            assert zobrist.key('boosting', 1) == k
+        finally:
+            zobrist._keys.clear()
+            zobrist._keys.update(saved)
+
+    def test_rotl(self):
+        assert zobrist.rotl(1) == 2
+        assert zobrist.rotl(1 << 63) == 1